@@ -2,4 +2,10 @@
 This is stacked decoder for IBMPC AT/XT keyboard
 '''
 
-from .pd import Decoder
+try:
+    import sigrokdecode
+except ImportError:
+    # Outside of libsigrokdecode only the engine module is usable.
+    pass
+else:
+    from .pd import Decoder
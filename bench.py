@@ -0,0 +1,272 @@
+#!/usr/bin/env python3
+'''
+Benchmark suite for the ibmpc_kbd decoder.
+
+Generates synthetic ibmpc_atxt traffic for Code Set 1, 2 and 3 and runs
+it through the decoder outside of libsigrokdecode, using a minimal
+stand-in for the sigrokdecode module. For every scenario and code set
+it reports bytes/sec, annotations/sec and peak memory of decoding for
+the previous if/elif decode(), the current Decoder (also with typematic
+repeats coalesced, with held key tracking, timing statistics and
+profiling counters), the bare engine.decode() generator and
+parallel.decode_parallel() across all cores.
+
+Usage: python3 bench.py [-n NBYTES] [-c CS] [-s SCENARIO] [-i IMPL]
+'''
+
+import argparse
+import importlib
+import os
+import random
+import sys
+import time
+import tracemalloc
+import types
+
+# Minimal stand-in for the sigrokdecode module, enough to run pd.py.
+srd = types.ModuleType('sigrokdecode')
+srd.OUTPUT_ANN, srd.OUTPUT_PYTHON, srd.OUTPUT_BINARY, srd.OUTPUT_META = range(4)
+srd.SRD_CONF_SAMPLERATE = 10000
+
+class SrdDecoder:
+    def register(self, output_type, **kwargs):
+        return output_type
+
+    def put(self, ss, es, output_id, data):
+        if output_id == srd.OUTPUT_ANN:
+            self.nputs += 1
+
+srd.Decoder = SrdDecoder
+sys.modules['sigrokdecode'] = srd
+
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(here))
+pd = importlib.import_module(os.path.basename(here) + '.pd')
+engine = importlib.import_module(os.path.basename(here) + '.engine')
+parallel = importlib.import_module(os.path.basename(here) + '.parallel')
+State, Ann = pd.State, pd.Ann
+
+class ChainDecoder(pd.Decoder):
+    # The if/elif state machine decode() used before the transition table.
+    def reset(self):
+        self.state = State.INIT
+
+    def end(self):
+        pass
+
+    def decode(self, ss, es, data):
+        direction, byte = data
+
+        if direction == 'H->D':
+            self.put(ss, es, self.out_ann, [Ann.DATA, ['Cmd: %s' % self.to_cmd(byte), 'C', 'C']])
+            self.state = State.INIT
+            return
+
+        if self.state == State.INIT:
+            if byte == 0xF0:
+                self.state = State.F0
+            elif byte == 0xE0:
+                self.state = State.E0
+            elif byte == 0xAA and self.options['cs'] in ['cs2', 'cs3']:
+                self.state = State.INIT
+                self.put(ss, es, self.out_ann, [Ann.DATA, ['BAT OK', 'OK', 'OK']])
+            elif byte == 0xFC and self.options['cs'] in ['cs2', 'cs3']:
+                self.state = State.INIT
+                self.put(ss, es, self.out_ann, [Ann.DATA, ['BAT NG', 'NG', 'NG']])
+            elif byte == 0xFA:
+                self.state = State.INIT
+                self.put(ss, es, self.out_ann, [Ann.DATA, ['Res: ACK', 'ACK', 'A']])
+            else:
+                self.state = State.INIT
+                if self.options['cs'] == 'cs1':
+                    if byte & 0x80:
+                        self.put(ss, es, self.out_ann, [Ann.DATA,
+                                ['↑: %s' % self.to_code(byte & 0x7F), '↑', '↑']])
+                    else:
+                        self.put(ss, es, self.out_ann, [Ann.DATA,
+                                ['↓: %s' % self.to_code(byte & 0x7F), '↓', '↓']])
+                else:
+                    self.put(ss, es, self.out_ann, [Ann.DATA,
+                            ['↓: %s' % self.to_code(byte), '↓', '↓']])
+
+        elif self.state == State.F0:
+            if byte == 0xE0:
+                self.state = State.F0_E0
+            else:
+                self.state = State.INIT
+                self.put(ss, es, self.out_ann, [Ann.DATA,
+                        ['↑: %s' % self.to_code(byte), '↑', '↑']])
+
+        elif self.state == State.E0:
+            self.state = State.INIT
+            self.put(ss, es, self.out_ann, [Ann.DATA,
+                    ['↓: %s' % self.to_e0_code(byte), '↓', '↓']])
+
+        elif self.state == State.F0_E0:
+            self.state = State.INIT
+            self.put(ss, es, self.out_ann, [Ann.DATA,
+                    ['↑: %s' % self.to_e0_code(byte), '↑', '↑']])
+
+# Sample times at 1MHz: ~12.5kHz bus clock, 11 bits per frame.
+BIT = 80
+FRAME = 11 * BIT
+
+# Left Shift per code set.
+shift_codes = {'cs1': 0x2A, 'cs2': 0x12, 'cs3': 0x12}
+
+class Traffic:
+    '''Synthetic ibmpc_atxt byte stream generator for one code set.'''
+
+    def __init__(self, cs, seed=0):
+        self.cs = cs
+        self.rnd = random.Random(seed)
+        maps = engine.code_set(cs)
+        codes, e0_codes = maps.codes, maps.e0
+        self.keys = sorted(c for c in codes if 0 < c < 0x80 and codes[c] != 'Unknown')
+        self.e0_keys = sorted(e0_codes)
+        self.records = []
+        self.t = 0
+
+    def byte(self, direction, byte):
+        self.records.append((self.t, self.t + FRAME, (direction, byte)))
+        self.t += FRAME + 2 * BIT
+
+    def make(self, code, e0=False):
+        if e0:
+            self.byte('D->H', 0xE0)
+        self.byte('D->H', code)
+
+    def brk(self, code, e0=False):
+        if e0:
+            self.byte('D->H', 0xE0)
+        if self.cs == 'cs1':
+            self.byte('D->H', code | 0x80)
+        else:
+            self.byte('D->H', 0xF0)
+            self.byte('D->H', code)
+
+    def command(self, cmd, *args, response=()):
+        # Host command and argument bytes, each ACKed by the device.
+        for byte in (cmd,) + args:
+            self.byte('H->D', byte)
+            self.byte('D->H', 0xFA)
+        for byte in response:
+            self.byte('D->H', byte)
+
+    def typing(self):
+        # Key strokes at ~10 keys/sec, some of them shifted.
+        shift = self.rnd.random() < 0.15
+        if shift:
+            self.make(shift_codes[self.cs])
+        code = self.rnd.choice(self.keys)
+        self.make(code)
+        self.t += 30000
+        self.brk(code)
+        if shift:
+            self.brk(shift_codes[self.cs])
+        self.t += 70000
+
+    def typematic(self):
+        # One key held down for a long repeat run.
+        code = self.rnd.choice(self.keys)
+        for i in range(self.rnd.randint(30, 300)):
+            self.make(code)
+            self.t += 33000
+        self.brk(code)
+
+    def e0(self):
+        # Navigation and media keys; Code Set 3 has no E0 prefix.
+        if not self.e0_keys:
+            return self.typing()
+        code = self.rnd.choice(self.e0_keys)
+        self.make(code, True)
+        self.t += 20000
+        self.brk(code, True)
+
+    def commands(self):
+        # LED updates, typematic setup and ID reads from the host.
+        self.command(0xED, self.rnd.randrange(8))
+        self.command(0xF3, self.rnd.randrange(0x80))
+        self.command(0xF2, response=(0xAB, 0x83))
+        self.command(0xF4)
+
+    def bat(self):
+        # Reset followed by the power-on self test result.
+        self.command(0xFF, response=(0xAA if self.rnd.random() < 0.95 else 0xFC,))
+        self.command(0xF0, 0x00, response=(0x02,))
+
+    def generate(self, scenario, nbytes):
+        step = getattr(self, scenario)
+        while len(self.records) < nbytes:
+            step()
+        return self.records[:nbytes]
+
+scenarios = ('typing', 'typematic', 'e0', 'commands', 'bat')
+
+def run_decoder(cls, records, cs, **options):
+    d = cls()
+    d.options = {o['id']: o['default'] for o in cls.options}
+    d.options.update(options, cs=cs)
+    d.nputs = 0
+    d.metadata(srd.SRD_CONF_SAMPLERATE, 1000000)
+    d.start()
+    decode = d.decode
+    for ss, es, data in records:
+        decode(ss, es, data)
+    d.end()
+    return d.nputs
+
+def run_engine(records, cs):
+    records = ((ss, es, direction, byte) for ss, es, (direction, byte) in records)
+    return sum(1 for _ in engine.decode(records, cs))
+
+def run_parallel(records, cs):
+    host = bytes(direction == 'H->D' for _, _, (direction, _) in records)
+    data = bytes(byte for _, _, (_, byte) in records)
+    return sum(1 for _ in parallel.decode_parallel(host, data, cs, chunk_size=1 << 16))
+
+impls = {
+    'chain': lambda records, cs: run_decoder(ChainDecoder, records, cs),
+    'decoder': lambda records, cs: run_decoder(pd.Decoder, records, cs),
+    'coalesce': lambda records, cs: run_decoder(pd.Decoder, records, cs,
+            typematic='coalesce'),
+    'held': lambda records, cs: run_decoder(pd.Decoder, records, cs, held='yes'),
+    'timing': lambda records, cs: run_decoder(pd.Decoder, records, cs, timing='yes'),
+    'profile': lambda records, cs: run_decoder(pd.Decoder, records, cs, profile='yes'),
+    'engine': run_engine,
+    'parallel': run_parallel,
+}
+
+def measure(impl, records, cs):
+    run = impls[impl]
+    t0 = time.perf_counter()
+    nanns = run(records, cs)
+    elapsed = time.perf_counter() - t0
+    # Separate run for memory, tracemalloc skews the timing.
+    tracemalloc.start()
+    run(records, cs)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return elapsed, nanns, peak
+
+def main():
+    parser = argparse.ArgumentParser(description='ibmpc_kbd decoder benchmark')
+    parser.add_argument('-n', '--nbytes', type=int, default=200000,
+            help='bytes per scenario (default 200000)')
+    parser.add_argument('-c', '--cs', action='append', choices=('cs1', 'cs2', 'cs3'))
+    parser.add_argument('-s', '--scenario', action='append', choices=scenarios)
+    parser.add_argument('-i', '--impl', action='append', choices=sorted(impls))
+    args = parser.parse_args()
+
+    print('%-10s %-4s %-8s %12s %12s %10s' %
+            ('scenario', 'cs', 'impl', 'bytes/s', 'anns/s', 'peak KiB'))
+    for scenario in args.scenario or scenarios:
+        for cs in args.cs or ('cs1', 'cs2', 'cs3'):
+            records = Traffic(cs).generate(scenario, args.nbytes)
+            for impl in args.impl or impls:
+                elapsed, nanns, peak = measure(impl, records, cs)
+                print('%-10s %-4s %-8s %12.0f %12.0f %10.1f' % (scenario, cs, impl,
+                        len(records) / elapsed, nanns / elapsed, peak / 1024))
+
+if __name__ == '__main__':
+    main()
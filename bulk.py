@@ -0,0 +1,112 @@
+'''
+Vectorized bulk decoding of large captures with NumPy
+
+Decodes whole arrays of bytes at once with the same tables as the
+engine module. Requires NumPy, unlike the rest of the package:
+
+    from ibmpc_kbd.bulk import decode_arrays
+    res = decode_arrays(host, data, 'cs2')
+
+host holds the direction of each byte (nonzero for H->D), data the byte
+values. Event i was decoded from byte res.index[i]; the events replayed
+after a broken sequence error share its index. kind, code and flags are
+as in engine.Event, flags holding the Anomaly of errors. e0, brk and e1
+are the Flag bits of key events, e1 set for Pause, and False for all
+other kinds.
+'''
+
+from collections import namedtuple
+import numpy as np
+from .engine import *
+
+Bulk = namedtuple('Bulk', 'index kind code flags e0 brk e1 end_state')
+
+_arrays = {}
+
+def lookup_arrays(cs):
+    # Flatten the engine transition table into parallel arrays indexed by
+    # (state << 8 | byte). kind is -1 where no event is emitted.
+    if cs in _arrays:
+        return _arrays[cs]
+    table, _ = compile_tables(cs)
+    next_state = np.array([s for s, _ in table], dtype=np.uint16)
+    kind = np.array([e.kind if e else -1 for _, e in table], dtype=np.int8)
+    code = np.array([e.code if e else 0 for _, e in table], dtype=np.uint8)
+    flags = np.array([e.flags if e else 0 for _, e in table], dtype=np.uint8)
+    # Bytes that lead to a state other than INIT from any state.
+    is_prefix = np.zeros(256, dtype=bool)
+    is_prefix[[i & 0xFF for i, (s, _) in enumerate(table) if s != State.INIT]] = True
+    # Events replayed after broken sequence errors, per slot the number
+    # of them and where they start in the replay arrays.
+    nreplay = np.array([len(e.replay) if e else 0 for _, e in table], dtype=np.int64)
+    replay_start = np.cumsum(nreplay) - nreplay
+    replayed = [r for _, e in table if e for r in e.replay]
+    replay = (np.array([r.kind for r in replayed], dtype=np.int8),
+            np.array([r.code for r in replayed], dtype=np.uint8),
+            np.array([r.flags for r in replayed], dtype=np.uint8))
+    _arrays[cs] = next_state, kind, code, flags, is_prefix, nreplay, replay_start, replay
+    return _arrays[cs]
+
+def decode_arrays(host, data, cs='cs2', state=State.INIT):
+    '''Decode a capture given as arrays, returning a Bulk of event arrays.
+
+    state is the engine state before the first byte; Bulk.end_state is
+    the state after the last one.
+    '''
+    next_state, kind, code, flags, is_prefix, nreplay, replay_start, replay = \
+            lookup_arrays(cs)
+    host = np.asarray(host).astype(bool)
+    data = np.asarray(data, dtype=np.uint8)
+    n = len(data)
+
+    # State before each byte. Any byte other than a device prefix or
+    # sequence byte leads back to INIT, so each state is first taken as
+    # if the byte before it came in INIT. That only fails after a byte
+    # taken in another state, so each pass recomputes the successors of
+    # the states that are not INIT or changed in the pass before. Runs
+    # of INIT, such as a held Left Control, drop out at once; the loop
+    # runs as often as the longest chain of other states is long (1-2
+    # for prefixes, up to 8 within an E1 sequence and its replay).
+    states = np.zeros(n, dtype=np.uint16)
+    prefix = is_prefix[data] & ~host
+    if n:
+        states[0] = state
+        states[1:] = np.where(prefix[:-1], next_state[data[:-1]], State.INIT)
+    idx = np.flatnonzero(prefix[:-1] & (states[:-1] != State.INIT)) + 1
+    while idx.size:
+        new = next_state[states[idx - 1] << 8 | data[idx - 1]]
+        changed = idx[new != states[idx]]
+        states[idx] = new
+        changed = changed[changed < n - 1]
+        idx = changed[prefix[changed]] + 1
+
+    slot = states << 8 | data
+    kinds = np.where(host, Kind.CMD, kind[slot])
+    codes = np.where(host, data, code[slot])
+    fl = np.where(host, 0, flags[slot])
+    index = np.flatnonzero(kinds >= 0)
+
+    end_state = State.INIT
+    if n and not host[-1]:
+        end_state = int(next_state[slot[-1]])
+
+    kinds, codes, fl = kinds[index], codes[index], fl[index]
+
+    # Insert the events replayed after broken sequence errors, at the
+    # index of the error.
+    slot = slot[index]
+    counts = np.where(host[index], 0, nreplay[slot])
+    if counts.any():
+        starts = np.cumsum(counts + 1) - counts - 1
+        rows = np.ones(len(index) + counts.sum(), dtype=bool)
+        rows[starts] = False
+        at = np.flatnonzero(rows)
+        src = np.repeat(replay_start[slot] - starts - 1, counts) + at
+        index = np.repeat(index, counts + 1)
+        kinds, codes, fl = (np.repeat(a, counts + 1) for a in (kinds, codes, fl))
+        kinds[at], codes[at], fl[at] = (a[src] for a in replay)
+
+    # Errors carry their Anomaly in flags, not key flag bits.
+    key = kinds == Kind.KEY
+    return Bulk(index, kinds, codes, fl, key & ((fl & Flag.E0) != 0),
+            key & ((fl & Flag.BREAK) != 0), key & ((fl & Flag.E1) != 0), end_state)
@@ -0,0 +1,584 @@
+'''
+IBM PC AT/XT keyboard decoding core, independent of libsigrokdecode
+
+Takes the (direction, byte) pairs produced by the ibmpc_atxt decoder and
+turns them into key events. Usable on its own for offline byte logs:
+
+    from ibmpc_kbd.engine import decode
+    for ss, es, event in decode(records, 'cs2'):
+        ...
+
+where records is an iterable of (ss, es, direction, byte) tuples.
+'''
+
+from collections import namedtuple
+from enum import IntEnum
+import itertools
+from .lists import *
+from .maps import KEYBOARD_PAGE, code_set
+
+class State(IntEnum):
+    INIT = 0
+    F0 = 1
+    E0 = 2
+    F0_E0 = 3
+
+class Kind(IntEnum):
+    KEY = 0
+    CMD = 1
+    RESPONSE = 2
+    ERROR = 3
+
+class Flag(IntEnum):
+    E0 = 1
+    BREAK = 2
+    E1 = 4
+
+class Anomaly(IntEnum):
+    UNKNOWN = 0
+    OVERRUN = 1
+    PREFIX = 2
+    SEQUENCE = 3
+    DANGLING = 4
+    SYNC = 5
+
+# Plain int copies for per-byte checks, enum member lookups are slow.
+E0, BREAK, E1 = int(Flag.E0), int(Flag.BREAK), int(Flag.E1)
+ERROR = int(Kind.ERROR)
+
+# Decoded event; prebuilt once per table slot and shared, never mutated.
+# code is the raw scan code (without prefix or CS1 break bit), command or
+# response byte. key is the normalized key id, the code with bit 8 set
+# for E0 keys and bit 9 for E1 keys, None for other kinds. name is the
+# key, command or response name, text holds the annotation strings,
+# longest first. usage is the USB HID usage of keys, page << 16 | usage
+# ID, 0 if there is none, None for other kinds. Errors carry their
+# Anomaly in flags. replay holds the events a broken sequence error is
+# followed by, the bytes after its first decoded again, () otherwise.
+Event = namedtuple('Event', 'kind cs code flags key name text usage replay',
+        defaults=((),))
+
+# Code sets, their maps are loaded on first use by maps.code_set().
+code_sets = ('cs1', 'cs2', 'cs3')
+
+# Prefix bytes: (state, byte) -> next state.
+prefixes = {
+    (State.INIT, 0xF0): State.F0,
+    (State.INIT, 0xE0): State.E0,
+    (State.F0, 0xE0): State.F0_E0,
+    (State.E0, 0xF0): State.F0_E0,
+}
+
+# Multi-byte sequences per code set, compiled into extra trie states of
+# the transition table. Each maps to the (code, flags) of the one key
+# event it stands for, or None to drop it.
+sequences = {
+    'cs1': {
+        # Pause sends make and break at once, on press.
+        (0xE1, 0x1D, 0x45, 0xE1, 0x9D, 0xC5): (0x1D, Flag.E1),
+        # Fake shifts wrapped around Print Screen and navigation keys.
+        (0xE0, 0x2A): None,
+        (0xE0, 0xAA): None,
+        (0xE0, 0x36): None,
+        (0xE0, 0xB6): None,
+    },
+    'cs2': {
+        (0xE1, 0x14, 0x77, 0xE1, 0xF0, 0x14, 0xF0, 0x77): (0x14, Flag.E1),
+        (0xE0, 0x12): None,
+        (0xE0, 0xF0, 0x12): None,
+        (0xE0, 0x59): None,
+        (0xE0, 0xF0, 0x59): None,
+    },
+    'cs3': {},
+}
+
+# Device responses recognized in INIT state per code set.
+response_codes = {
+    'cs1': (0xFA,),
+    'cs2': (0xAA, 0xFC, 0xFA),
+    'cs3': (0xAA, 0xFC, 0xFA),
+}
+
+# Key detection error or overrun code, received in place of a key code.
+overrun_codes = {
+    'cs1': 0xFF,
+    'cs2': 0x00,
+    'cs3': 0x00,
+}
+
+# Key flags and annotation arrow per state a key code is received in.
+key_states = {
+    State.INIT: (0, '↓'),
+    State.F0: (Flag.BREAK, '↑'),
+    State.E0: (Flag.E0, '↓'),
+    State.F0_E0: (Flag.E0 | Flag.BREAK, '↑'),
+}
+
+def key_id(code, flags):
+    return code | (0x100 if flags & E0 else 0) | (0x200 if flags & E1 else 0)
+
+def key_event(cs, code, flags, arrow, codes, usages):
+    name = codes.get(code, '???')
+    key = key_id(code, flags)
+    return Event(Kind.KEY, cs, code, flags, key, name,
+            ['%s: %s' % (arrow, name), arrow, arrow], usages[key])
+
+def error_event(cs, byte, anomaly, name, replay=()):
+    return Event(Kind.ERROR, cs, byte, anomaly, None, name,
+            ['Error: %s' % name, name, 'E'], None, replay)
+
+def cmd_event(cs, byte):
+    name = cmds.get(byte, '???')
+    return Event(Kind.CMD, cs, byte, 0, None, name, ['Cmd: %s' % name, 'C', 'C'], None)
+
+_tables = {}
+# Distinct prebuilt events per code set and overlay, in table order, and
+# the index of each by id(), to refer to events in saved decoder state.
+_events = {}
+_event_index = {}
+
+def compile_tables(cs, overlay=None):
+    # Compile a code set, with the entries of a vendor overlay map file on
+    # top, into a flat transition table indexed by (state << 8 | byte),
+    # giving the next state and the event to emit (None for prefix
+    # bytes), plus a 256-slot host command table.
+    if (cs, overlay) in _tables:
+        return _tables[cs, overlay]
+    maps = code_set(cs, overlay)
+    events = {}
+    for state, (flags, arrow) in key_states.items():
+        table = maps.e0 if flags & Flag.E0 else maps.codes
+        events[state] = [key_event(cs, byte, flags, arrow, table, maps.usages)
+                for byte in range(256)]
+    if cs == 'cs1':
+        # Code Set 1 breaks are the make code with bit 7 set.
+        for make, brk in ((State.INIT, State.F0), (State.E0, State.F0_E0)):
+            for byte in range(0x80, 0x100):
+                events[make][byte] = events[brk][byte & 0x7F]
+    for byte in response_codes[cs]:
+        text = responses[byte]
+        events[State.INIT][byte] = Event(Kind.RESPONSE, cs, byte, 0, None,
+                text[0], list(text), None)
+
+    table = [(State.INIT, event) for state in State for event in events[state]]
+    for (state, byte), next_state in prefixes.items():
+        table[state << 8 | byte] = (next_state, None)
+    byte = overrun_codes[cs]
+    table[byte] = (State.INIT, error_event(cs, byte, Anomaly.OVERRUN, 'Overrun'))
+
+    # Walk each sequence from INIT along existing prefix states, adding a
+    # trie state where there is none. Prefix states are shared only when
+    # entered from INIT or another prefix state, never from a trie state.
+    nstates = len(State)
+    paths = {}
+    for seq, key in sequences[cs].items():
+        state = State.INIT
+        for n, byte in enumerate(seq[:-1]):
+            next_state = (table[state << 8 | byte] or (State.INIT,))[0]
+            if next_state == State.INIT or (state >= len(State) and next_state < len(State)):
+                table += [None] * 256
+                table[state << 8 | byte] = (nstates, None)
+                next_state = nstates
+                paths[nstates] = seq[:n + 1]
+                nstates += 1
+            state = next_state
+        event = None
+        if key:
+            code, flags = key
+            event = key_event(cs, code, flags, '↓', maps.e1, maps.usages)
+        table[state << 8 | seq[-1]] = (State.INIT, event)
+
+    # A prefix byte that does not continue the pending prefix restarts it.
+    for state in (State.F0, State.E0, State.F0_E0):
+        for byte in (0xF0, 0xE0, 0xE1):
+            next_state = table[byte][0]
+            if next_state != State.INIT and table[state << 8 | byte][0] == State.INIT:
+                table[state << 8 | byte] = (next_state, error_event(cs, byte,
+                        Anomaly.PREFIX, 'Broken prefix %s %02X' % (state.name, byte)))
+
+    # A byte off a sequence is a broken sequence error, replaying the
+    # bytes taken after its first one and the byte itself from INIT, so
+    # no key event is lost. The replay is fixed per slot and bounded by
+    # the longest sequence; it is precomputed by running the table, and
+    # the error is followed by the replayed events in one flat list.
+    def run(data):
+        state, events = State.INIT, []
+        for byte in data:
+            slot = state << 8 | byte
+            if table[slot] is None:
+                broken(slot)
+            state, event = table[slot]
+            if event:
+                events.append(event._replace(replay=()) if event.replay else event)
+                events += event.replay
+        return state, events
+
+    def broken(slot):
+        seq = paths[slot >> 8]
+        state, events = run(seq[1:] + (slot & 0xFF,))
+        table[slot] = (state, error_event(cs, slot & 0xFF, Anomaly.SEQUENCE,
+                'Broken sequence %s' % ' '.join('%02X' % byte for byte in seq),
+                tuple(events)))
+
+    for slot in range(len(State) << 8, len(table)):
+        if table[slot] is None:
+            broken(slot)
+
+    cmds = [cmd_event(cs, byte) for byte in range(256)]
+    events = [event for _, event in table if event]
+    events += [replayed for event in events for replayed in event.replay]
+    events = _events[cs, overlay] = list({id(event): event for event in
+            events + cmds}.values())
+    for i, event in enumerate(events):
+        _event_index[id(event)] = i
+    _tables[cs, overlay] = table, cmds
+    return table, cmds
+
+def event_index(event):
+    '''The index of a prebuilt event among those of its code set.'''
+    return _event_index[id(event)]
+
+def event_at(cs, overlay, index):
+    '''The prebuilt event event_index() gave index for.'''
+    compile_tables(cs, overlay)
+    return _events[cs, overlay][index]
+
+class Engine:
+    '''Per-byte state machine for one code set.'''
+
+    def __init__(self, cs='cs2', overlay=None):
+        self.cs = cs
+        self.overlay = overlay
+        self.table, self.cmds = compile_tables(cs, overlay)
+        self.reset()
+
+    def reset(self):
+        self.state = State.INIT
+
+    def feed(self, direction, byte):
+        '''Advance by one byte, returning the decoded Event or None.'''
+        if direction == 'H->D':
+            self.state = State.INIT
+            return self.cmds[byte]
+
+        self.state, event = self.table[self.state << 8 | byte]
+        return event
+
+class HeldKeys:
+    '''Currently held keys, as a bitmap over normalized key ids.'''
+
+    def __init__(self):
+        self.bits = bytearray(0x300 >> 3)
+        self.since = [0] * 0x300
+        self.held = []
+        self.max = 0
+
+    def press(self, event, ss):
+        '''Mark a key held; False if it already was (typematic repeat).'''
+        key = event.key
+        mask = 1 << (key & 7)
+        if self.bits[key >> 3] & mask:
+            return False
+        self.bits[key >> 3] |= mask
+        self.since[key] = ss
+        self.held.append(event)
+        if len(self.held) > self.max:
+            self.max = len(self.held)
+        return True
+
+    def release(self, event):
+        '''Mark a key released; False if it was not held (phantom break).'''
+        key = event.key
+        mask = 1 << (key & 7)
+        if not self.bits[key >> 3] & mask:
+            return False
+        self.bits[key >> 3] ^= mask
+        # Bounded by the number of keys held at once.
+        for i, held in enumerate(self.held):
+            if held.key == key:
+                del self.held[i]
+                break
+        return True
+
+    def clear(self):
+        for event in self.held:
+            self.bits[event.key >> 3] = 0
+        del self.held[:]
+
+class TypedText:
+    '''Text typed by key events, as on a US layout.
+
+    Tracks the modifiers held and Caps and Num Lock toggled by their own
+    key presses, the host's indicator state is not known.
+    '''
+
+    # Keyboard page usages
+    CAPS_LOCK, NUM_LOCK = 0x39, 0x53
+    RETURN, KEYPAD_ENTER, BACKSPACE = 0x28, 0x58, 0x2A
+
+    def __init__(self):
+        # Bit n for usage 0xE0 + n held: Ctrl, Shift, Alt, GUI left then right.
+        self.mods = 0
+        self.caps = False
+        self.num = False
+        self.locks_held = set()
+
+    def feed(self, event):
+        '''Text typed by a key event, '\n' for Return, '\b' for Backspace,
+        '^X' for Ctrl combinations, or None.'''
+        usage = event.usage
+        if not usage or usage >> 16 != KEYBOARD_PAGE:
+            return
+        usage &= 0xFFFF
+        brk = event.flags & BREAK
+        if 0xE0 <= usage <= 0xE7:
+            if brk:
+                self.mods &= ~(1 << (usage - 0xE0))
+            else:
+                self.mods |= 1 << (usage - 0xE0)
+            return
+        if usage in (self.CAPS_LOCK, self.NUM_LOCK):
+            # Toggle on press, not on its typematic repeats.
+            if brk:
+                self.locks_held.discard(usage)
+            elif usage not in self.locks_held:
+                self.locks_held.add(usage)
+                if usage == self.CAPS_LOCK:
+                    self.caps = not self.caps
+                else:
+                    self.num = not self.num
+            return
+        if brk or self.mods & 0xCC:
+            # Alt and GUI combinations type nothing.
+            return
+        if usage in (self.RETURN, self.KEYPAD_ENTER):
+            return '\n'
+        if usage == self.BACKSPACE:
+            return '\b'
+        chars = hid_chars.get(usage)
+        if chars:
+            if self.mods & 0x11:
+                return '^' + chars[0].upper()
+            shift = bool(self.mods & 0x22)
+            if self.caps and chars[0].isalpha():
+                shift = not shift
+            return chars[shift]
+        if self.num and usage in hid_keypad_chars:
+            return hid_keypad_chars[usage]
+
+# Replies to a Select Scan Code query (argument 0), untranslated and
+# translated by an 8042 controller.
+select_replies = {
+    0x01: 'cs1', 0x02: 'cs2', 0x03: 'cs3',
+    0x43: 'cs1', 0x41: 'cs2', 0x3F: 'cs3',
+}
+
+class Detector:
+    '''Infers the code set from a bounded look-ahead of the stream.'''
+
+    def __init__(self, limit=128):
+        # Typematic repeats do not count towards the limit, up to 16 times
+        # the limit in total.
+        self.limit = limit
+        self.nbytes = 0
+        self.nrepeats = 0
+        self.votes = dict.fromkeys(code_sets, 0)
+        self.prev = None
+        self.select = None
+        self.makes = bytearray(0x80)
+
+    def feed(self, direction, byte):
+        '''Take one byte, returning the code set once decided, else None.'''
+        if direction == 'D->H' and byte == self.prev:
+            self.nrepeats += 1
+        else:
+            self.nbytes += 1
+        if direction == 'H->D':
+            cs = self.host(byte)
+        else:
+            cs = self.device(byte)
+        if not cs and (self.nbytes >= self.limit or self.nrepeats >= 15 * self.limit):
+            cs = self.result()
+        return cs
+
+    def result(self):
+        # Best vote so far, ties go to Code Set 2, the power-on default.
+        return max(('cs2', 'cs1', 'cs3'), key=self.votes.get)
+
+    def host(self, byte):
+        # Select Scan Code (F0) with a set argument is decisive; argument 0
+        # asks the keyboard to reply with its current set.
+        select, self.select = self.select, None
+        if select == 'arg':
+            if byte == 0:
+                self.select = 'query'
+            return select_replies.get(byte) if byte < 4 else None
+        if byte == 0xF0:
+            self.select = 'arg'
+
+    def device(self, byte):
+        votes = self.votes
+        if self.select == 'query' and byte != 0xFA:
+            self.select = None
+            return select_replies.get(byte)
+        prev, self.prev = self.prev, byte
+        if prev == 0xE0:
+            # E0 F0 xx is a CS2 break, CS1 E0 breaks have bit 7 set and
+            # CS3 has no E0 prefix at all.
+            if byte == 0xF0:
+                return 'cs2'
+            if byte & 0x80:
+                return 'cs1'
+            votes['cs1'] += 2
+            votes['cs2'] += 2
+        elif prev == 0xF0:
+            # F0 break prefix, unused in CS1.
+            votes['cs2'] += 2
+            votes['cs3'] += 2
+        elif byte & 0x80:
+            if byte in (0xE0, 0xE1, 0xF0, 0xFA, 0xFE):
+                return
+            if self.makes[byte & 0x7F]:
+                # CS1 break of a key seen made before.
+                votes['cs1'] += 4
+            elif byte == 0xAA:
+                votes['cs2'] += 1
+        elif not self.makes[byte]:
+            # Valid code ratio, counted once per distinct code.
+            self.makes[byte] = 1
+            for cs in code_sets:
+                if byte in code_set(cs).codes:
+                    votes[cs] += 1
+
+# Host commands that take argument bytes or get replies besides the ACK:
+# (argument bytes, reply bytes after the ACKs).
+cmd_specs = {
+    0xED: (1, 0),
+    0xEE: (0, 1),
+    0xF0: (1, 0),
+    0xF2: (0, 2),
+    0xF3: (1, 0),
+    0xFF: (0, 1),
+}
+
+# A host command exchange. args and replies are byte lists, latencies the
+# samples from the end of each host byte to the start of its ACK.
+Transaction = namedtuple('Transaction', 'ss es cmd args replies latencies resends')
+
+def leds_str(mask):
+    leds = [name for bit, name in ((4, 'Caps'), (2, 'Num'), (1, 'Scroll')) if mask & bit]
+    return '+'.join(leds) or 'off'
+
+def typematic_str(arg):
+    # Period is (8 + A) * 2^B * 4.17ms with A in bits 0-2 and B in bits 3-4,
+    # the delay is 250ms times bits 5-6 plus one.
+    period = (8 + (arg & 7)) * (1 << (arg >> 3 & 3)) * 0.00417
+    return '%.1f/s, %dms' % (1 / period, ((arg >> 5 & 3) + 1) * 250)
+
+def transaction_str(t):
+    # Command name with its arguments and replies decoded.
+    text = cmds.get(t.cmd, '???')
+    if t.cmd == 0xED and t.args:
+        text += ': ' + leds_str(t.args[0])
+    elif t.cmd == 0xF3 and t.args:
+        text += ': ' + typematic_str(t.args[0])
+    elif t.cmd == 0xF0 and t.args:
+        cs = t.replies[0] if t.args[0] == 0 and t.replies else t.args[0]
+        text += ': %s%s' % ('query ' if t.args[0] == 0 else '',
+                select_replies.get(cs, '%02X' % cs))
+    elif t.cmd == 0xF2 and t.replies:
+        text += ': ' + ' '.join('%02X' % byte for byte in t.replies)
+    elif t.cmd == 0xFF and t.replies:
+        text += ': ' + responses.get(t.replies[0], ('%02X' % t.replies[0],))[0]
+    return text
+
+class Transactions:
+    '''Pairs host commands with their arguments, ACKs and replies.'''
+
+    def __init__(self):
+        self.cmd = None
+
+    def feed(self, ss, es, direction, byte):
+        '''Take one byte, returning a finished Transaction or None.
+
+        Device bytes not expected by a pending command are ignored.
+        '''
+        if direction == 'H->D':
+            if self.cmd is not None and self.unacked is None:
+                if self.resend:
+                    # Host repeating its last byte after a Resend.
+                    self.resend = False
+                    self.unacked = es
+                    return
+                if self.nargs:
+                    self.nargs -= 1
+                    self.args.append(byte)
+                    self.unacked = es
+                    return
+            done = self.finish()
+            self.cmd, self.ss, self.es = byte, ss, es
+            self.nargs, self.nreplies = cmd_specs.get(byte, (0, 0))
+            self.args, self.replies, self.latencies = [], [], []
+            self.resends = 0
+            self.resend = False
+            self.unacked = es
+            return done
+
+        if self.cmd is None:
+            return
+        if self.unacked is not None and byte in (0xFA, 0xFE):
+            self.latencies.append(ss - self.unacked)
+            self.unacked = None
+            if byte == 0xFE:
+                self.resends += 1
+                self.resend = True
+            elif self.cmd == 0xF0 and self.args == [0]:
+                # Select Scan Code query, the current set follows.
+                self.nreplies = 1
+        elif self.nreplies and (self.unacked is None or self.cmd == 0xEE):
+            # Replies follow the ACK, Echo is answered without one.
+            self.replies.append(byte)
+            self.nreplies -= 1
+            self.unacked = None
+        else:
+            return
+        self.es = es
+        if not (self.resend or self.nargs or self.nreplies):
+            return self.finish()
+
+    def finish(self):
+        '''Close the pending exchange, complete or not, and return it.'''
+        if self.cmd is None:
+            return
+        cmd, self.cmd = self.cmd, None
+        return Transaction(self.ss, self.es, cmd, self.args, self.replies,
+                self.latencies, self.resends)
+
+def decode(records, cs='cs2', overlay=None):
+    '''Decode (ss, es, direction, byte) records, yielding (ss, es, event).
+
+    With cs 'auto' the code set is detected from the first records, which
+    are buffered until then. overlay is a vendor map file, see maps.py.
+    The events replayed after a broken sequence error follow it.
+    '''
+    records = iter(records)
+    if cs == 'auto':
+        detector = Detector()
+        buffered = []
+        for record in records:
+            buffered.append(record)
+            cs = detector.feed(*record[2:])
+            if cs:
+                break
+        else:
+            cs = detector.result()
+        records = itertools.chain(buffered, records)
+
+    feed = Engine(cs, overlay).feed
+    for ss, es, direction, byte in records:
+        event = feed(direction, byte)
+        if event:
+            yield ss, es, event
+            if event.replay:
+                for replayed in event.replay:
+                    yield ss, es, replayed
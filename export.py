@@ -0,0 +1,204 @@
+'''
+Columnar binary export of decoded events
+
+A file holds one fixed-width value per event in each of five columns,
+so tools can mmap it and slice or filter columns without parsing:
+
+    offset         contents
+    0              header, 64 bytes
+    64             ss, n little-endian uint64
+    64 + 8n        es, n little-endian uint64
+    64 + 16n       kind, n uint8 (engine.Kind)
+    64 + 17n       code, n uint8
+    64 + 18n       flags, n uint8 (engine.Flag)
+
+The header is HEADER: magic, format version, code set name, samplerate
+(0 if unknown) and event count.
+
+Files are written offline from (ss, es, direction, byte) records:
+
+    from ibmpc_kbd.engine import Flag
+    from ibmpc_kbd.export import export, Reader
+    export(records, 'capture.kbe', 'cs2', samplerate)
+    with Reader('capture.kbe') as r:
+        cols = r.arrays()
+        breaks = cols['ss'][cols['flags'] & Flag.BREAK != 0]
+
+or converted from the decoder's 'events' binary output, a stream of
+RECORD structs, with:
+
+    sigrok-cli ... -P ibmpc_atxt,ibmpc_kbd:events=yes -B ibmpc_kbd=events > events.bin
+    python3 -m ibmpc_kbd.export events.bin capture.kbe -c cs2 -r 1000000
+'''
+
+import argparse
+import array
+import mmap
+import shutil
+import struct
+import sys
+import tempfile
+from .engine import decode
+
+MAGIC = b'IBMKBDEV'
+VERSION = 1
+HEADER = struct.Struct('<8sH6sQQ32x')
+
+# One event of the decoder's binary output: ss, es, kind, code, flags.
+RECORD = struct.Struct('<QQBBB')
+
+# Column names and array typecodes, in file order.
+COLUMNS = (('ss', 'Q'), ('es', 'Q'), ('kind', 'B'), ('code', 'B'), ('flags', 'B'))
+
+class Writer:
+    '''Writes events to a columnar file.
+
+    Columns are buffered in arrays of up to block events and spilled to
+    temporary files, which close() joins behind the header, so memory
+    does not grow with the number of events. count is set on close().
+    '''
+
+    def __init__(self, path, cs, samplerate=0, block=65536):
+        self.file = open(path, 'wb')
+        self.cs = cs
+        self.samplerate = samplerate or 0
+        self.block = block
+        self.count = 0
+        self.bufs = [array.array(t) for _, t in COLUMNS]
+        self.spill = [tempfile.TemporaryFile() for _ in COLUMNS]
+
+    def add(self, ss, es, kind, code, flags):
+        ss_buf, es_buf, kind_buf, code_buf, flags_buf = self.bufs
+        ss_buf.append(ss)
+        es_buf.append(es)
+        kind_buf.append(kind)
+        code_buf.append(code)
+        flags_buf.append(flags)
+        if len(ss_buf) >= self.block:
+            self.flush()
+
+    def flush(self):
+        for buf, f in zip(self.bufs, self.spill):
+            if sys.byteorder == 'big':
+                buf.byteswap()
+            buf.tofile(f)
+            del buf[:]
+
+    def close(self):
+        if self.file.closed:
+            return
+        self.flush()
+        self.count = self.spill[0].tell() // 8
+        self.file.write(HEADER.pack(MAGIC, VERSION, self.cs.encode(),
+                self.samplerate, self.count))
+        for f in self.spill:
+            f.seek(0)
+            shutil.copyfileobj(f, self.file)
+            f.close()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+class Reader:
+    '''Memory-mapped view of a columnar event file.'''
+
+    def __init__(self, path):
+        self.file = open(path, 'rb')
+        self.mm = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(self.mm) < HEADER.size:
+            raise ValueError('%s: truncated header' % path)
+        magic, version, cs, self.samplerate, self.count = HEADER.unpack_from(self.mm)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError('%s: not an event file' % path)
+        self.cs = cs.rstrip(b'\0').decode()
+        self.offsets = {}
+        offset = HEADER.size
+        for name, t in COLUMNS:
+            self.offsets[name] = offset
+            offset += self.count * array.array(t).itemsize
+        if len(self.mm) < offset:
+            raise ValueError('%s: truncated columns' % path)
+
+    def __len__(self):
+        return self.count
+
+    def column(self, name):
+        '''Zero-copy memoryview of one column, native byte order assumed
+        little-endian.'''
+        t = dict(COLUMNS)[name]
+        start = self.offsets[name]
+        end = start + self.count * array.array(t).itemsize
+        return memoryview(self.mm)[start:end].cast(t)
+
+    def arrays(self):
+        '''Zero-copy NumPy arrays of all columns, by name. Needs NumPy.'''
+        import numpy as np
+        return {name: np.frombuffer(self.mm, dtype='<u8' if t == 'Q' else 'u1',
+                count=self.count, offset=self.offsets[name])
+                for name, t in COLUMNS}
+
+    def __iter__(self):
+        return zip(*(self.column(name) for name, _ in COLUMNS))
+
+    def close(self):
+        # Views handed out keep the mapping alive until released.
+        try:
+            self.mm.close()
+        except BufferError:
+            pass
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def export(records, path, cs='cs2', samplerate=0):
+    '''Decode (ss, es, direction, byte) records into an event file.
+
+    Returns the number of events written.
+    '''
+    event = None
+    with Writer(path, cs, samplerate) as w:
+        add = w.add
+        for ss, es, event in decode(records, cs):
+            add(ss, es, event.kind, event.code, event.flags)
+        if event is not None:
+            # The detected one with cs 'auto'.
+            w.cs = event.cs
+    return w.count
+
+def convert(src, path, cs, samplerate=0):
+    '''Convert a stream of RECORD structs into an event file.'''
+    size = RECORD.size
+    with Writer(path, cs, samplerate) as w:
+        while True:
+            chunk = src.read(size * 4096)
+            for record in RECORD.iter_unpack(chunk[:len(chunk) - len(chunk) % size]):
+                w.add(*record)
+            if len(chunk) < size * 4096:
+                break
+    return w.count
+
+def main():
+    parser = argparse.ArgumentParser(
+            description="Convert the decoder's 'events' binary output to an event file")
+    parser.add_argument('src', help="binary output file, '-' for stdin")
+    parser.add_argument('dst', help='event file to write')
+    parser.add_argument('-c', '--cs', default='cs2', choices=('cs1', 'cs2', 'cs3'))
+    parser.add_argument('-r', '--samplerate', type=int, default=0)
+    args = parser.parse_args()
+    if args.src == '-':
+        n = convert(sys.stdin.buffer, args.dst, args.cs, args.samplerate)
+    else:
+        with open(args.src, 'rb') as src:
+            n = convert(src, args.dst, args.cs, args.samplerate)
+    print('%d events' % n)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+# Host to device commands
+cmds = {
+    0xED: 'Set Indicator',
+    0xEE: 'Echo',
+    0xF0: 'Select Scan Code',
+    0xF2: 'Read ID',
+    0xF3: 'Set Typematic Rate/Delay',
+    0xF4: 'Enable',
+    0xF5: 'Default Disable',
+    0xF6: 'Set Default',
+    0xF7: 'Set All Keys - Typematic',
+    0xF8: 'Set All Keys - Make/Break',
+    0xF9: 'Set All Keys - Make',
+    0xFA: 'Set All Keys - Typematic/Make/Break',
+    0xFB: 'Set Key Type - Typematic',
+    0xFC: 'Set Key Type - Make/Break',
+    0xFD: 'Set Key Type - Make',
+    0xFE: 'Resend',
+    0xFF: 'Reset',
+}
+
+# Device responses
+responses = {
+    0xAA: ('BAT OK', 'OK', 'OK'),
+    0xFA: ('Res: ACK', 'ACK', 'A'),
+    0xFC: ('BAT NG', 'NG', 'NG'),
+}
+
+# PS/2 mouse host commands
+mouse_cmds = {
+    0xE6: 'Set Scaling 1:1',
+    0xE7: 'Set Scaling 2:1',
+    0xE8: 'Set Resolution',
+    0xE9: 'Status Request',
+    0xEA: 'Set Stream Mode',
+    0xEB: 'Read Data',
+    0xEC: 'Reset Wrap Mode',
+    0xEE: 'Set Wrap Mode',
+    0xF0: 'Set Remote Mode',
+    0xF2: 'Get Device ID',
+    0xF3: 'Set Sample Rate',
+    0xF4: 'Enable Data Reporting',
+    0xF5: 'Disable Data Reporting',
+    0xF6: 'Set Defaults',
+    0xFE: 'Resend',
+    0xFF: 'Reset',
+}
+
+# PS/2 mouse command responses
+mouse_responses = {
+    0xFA: ('Res: ACK', 'ACK', 'A'),
+    0xFC: ('Res: Error', 'Error', 'E'),
+    0xFE: ('Res: Resend', 'Resend', 'R'),
+}
+
+# Keyboard page usage to US layout characters, unshifted and shifted
+hid_chars = {
+    0x04: ('a', 'A'), 0x05: ('b', 'B'), 0x06: ('c', 'C'), 0x07: ('d', 'D'),
+    0x08: ('e', 'E'), 0x09: ('f', 'F'), 0x0A: ('g', 'G'), 0x0B: ('h', 'H'),
+    0x0C: ('i', 'I'), 0x0D: ('j', 'J'), 0x0E: ('k', 'K'), 0x0F: ('l', 'L'),
+    0x10: ('m', 'M'), 0x11: ('n', 'N'), 0x12: ('o', 'O'), 0x13: ('p', 'P'),
+    0x14: ('q', 'Q'), 0x15: ('r', 'R'), 0x16: ('s', 'S'), 0x17: ('t', 'T'),
+    0x18: ('u', 'U'), 0x19: ('v', 'V'), 0x1A: ('w', 'W'), 0x1B: ('x', 'X'),
+    0x1C: ('y', 'Y'), 0x1D: ('z', 'Z'),
+    0x1E: ('1', '!'), 0x1F: ('2', '@'), 0x20: ('3', '#'), 0x21: ('4', '$'),
+    0x22: ('5', '%'), 0x23: ('6', '^'), 0x24: ('7', '&'), 0x25: ('8', '*'),
+    0x26: ('9', '('), 0x27: ('0', ')'),
+    0x2B: ('\t', '\t'), 0x2C: (' ', ' '),
+    0x2D: ('-', '_'), 0x2E: ('=', '+'), 0x2F: ('[', '{'), 0x30: (']', '}'),
+    0x31: ('\\', '|'), 0x32: ('#', '~'), 0x33: (';', ':'), 0x34: ('\'', '"'),
+    0x35: ('`', '~'), 0x36: (',', '<'), 0x37: ('.', '>'), 0x38: ('/', '?'),
+    0x54: ('/', '/'), 0x55: ('*', '*'), 0x56: ('-', '-'), 0x57: ('+', '+'),
+    0x64: ('\\', '|'), 0x67: ('=', '='), 0x85: (',', ','),
+}
+
+# Keypad usage to characters, with Num Lock on
+hid_keypad_chars = {
+    0x59: '1', 0x5A: '2', 0x5B: '3', 0x5C: '4', 0x5D: '5', 0x5E: '6',
+    0x5F: '7', 0x60: '8', 0x61: '9', 0x62: '0', 0x63: '.',
+}
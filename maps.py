@@ -0,0 +1,132 @@
+'''
+Scan code maps
+
+The names and USB HID usages of each code set live in maps/<cs>.txt and
+are read on first use of the code set, one entry per line:
+
+    # code  usage  name
+    1C      04     a A
+    E071    4C     Delete
+    E037    01:81  System Power
+
+Codes are hex, E0 and E1 prefixed ones written E0xx and E1xx. Usages are
+Keyboard/Keypad page (07) IDs, or page:ID for other pages, - for none.
+
+A vendor overlay file in the same format adds or replaces entries, for
+example for terminal boards or Japanese and Korean layouts. Its entries
+apply to the code set being decoded, or to the one named by the last
+'[cs1]', '[cs2]' or '[cs3]' line before them. A code set merged with an
+overlay is cached on disk, under $XDG_CACHE_HOME/ibmpc_kbd, until the
+overlay changes.
+'''
+
+from collections import namedtuple
+import hashlib
+import json
+import os
+import tempfile
+
+# Names by code of plain, E0 and E1 prefixed codes, and USB HID usages,
+# page << 16 | usage ID, in a list by key id, 0 where there is none.
+CodeSet = namedtuple('CodeSet', 'codes e0 e1 usages')
+
+FORMAT = 2
+KEYBOARD_PAGE = 0x07
+
+here = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'maps')
+
+def parse_usage(text):
+    if text == '-':
+        return 0
+    if ':' in text:
+        page, usage = text.split(':')
+        return int(page, 16) << 16 | int(usage, 16)
+    return KEYBOARD_PAGE << 16 | int(text, 16)
+
+def parse(lines, cs=None):
+    '''Map file entries as {cs: {key id: (usage, name)}}, cs the code
+    set of entries before any section line.'''
+    maps = {}
+    entries = maps.setdefault(cs, {}) if cs else None
+    for n, line in enumerate(lines, 1):
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        if line.startswith('[') and line.endswith(']'):
+            section = line[1:-1].strip().lower()
+            if section not in ('cs1', 'cs2', 'cs3'):
+                raise ValueError('line %d: unknown code set %r' % (n, section))
+            entries = maps.setdefault(section, {})
+            continue
+        fields = line.split(None, 2)
+        if entries is None or len(fields) < 3:
+            raise ValueError('line %d: bad entry %r' % (n, line))
+        code, usage, name = fields
+        try:
+            key = int(code, 16)
+            if len(code) == 4 and key >> 8 in (0xE0, 0xE1):
+                key = (0x100 if key >> 8 == 0xE0 else 0x200) | key & 0xFF
+            elif key > 0xFF:
+                raise ValueError
+            entries[key] = parse_usage(usage), name
+        except ValueError:
+            raise ValueError('line %d: bad entry %r' % (n, line))
+    return maps
+
+def read(path, cs=None):
+    with open(path, encoding='utf-8') as f:
+        try:
+            return parse(f, cs)
+        except ValueError as e:
+            raise ValueError('%s: %s' % (path, e))
+
+def build(entries):
+    planes = {}, {}, {}
+    usages = [0] * 0x300
+    for key, (usage, name) in sorted(entries.items()):
+        planes[key >> 8][key & 0xFF] = name
+        usages[key] = usage
+    return CodeSet(*planes, usages)
+
+def cache_dir():
+    return os.path.join(os.environ.get('XDG_CACHE_HOME') or
+            os.path.expanduser(os.path.join('~', '.cache')), 'ibmpc_kbd')
+
+def compile_overlay(cs, path):
+    # Cached by everything the result depends on, so a changed file
+    # simply misses. The cache holds the merged entries as JSON, a bad
+    # one is rebuilt and failing to write it is not an error.
+    base = os.path.join(here, cs + '.txt')
+    st, base_st = os.stat(path), os.stat(base)
+    tag = '%d %s %s %d %d %d' % (FORMAT, cs, os.path.abspath(path),
+            st.st_mtime_ns, st.st_size, base_st.st_mtime_ns)
+    cache = os.path.join(cache_dir(), hashlib.sha1(tag.encode()).hexdigest())
+    try:
+        with open(cache, encoding='utf-8') as f:
+            return build({key: (usage, name) for key, usage, name in json.load(f)})
+    except (OSError, ValueError, TypeError, IndexError):
+        pass
+    entries = read(base, cs)[cs]
+    entries.update(read(path, cs).get(cs, {}))
+    try:
+        os.makedirs(cache_dir(), exist_ok=True)
+        with tempfile.NamedTemporaryFile('w', encoding='utf-8', dir=cache_dir(),
+                delete=False) as f:
+            json.dump([[key, usage, name] for key, (usage, name) in sorted(entries.items())],
+                    f, ensure_ascii=False)
+        os.replace(f.name, cache)
+    except OSError:
+        pass
+    return build(entries)
+
+_code_sets = {}
+
+def code_set(cs, overlay=None):
+    '''The CodeSet of cs, with the entries of the overlay file on top.'''
+    key = cs, overlay
+    if key not in _code_sets:
+        if overlay:
+            _code_sets[key] = compile_overlay(cs, overlay)
+        else:
+            _code_sets[key] = build(read(os.path.join(here, cs + '.txt'), cs)[cs])
+    return _code_sets[key]
@@ -0,0 +1,179 @@
+'''
+PS/2 mouse decoding, independent of libsigrokdecode
+
+Assembles the movement packets of a PS/2 mouse from the (direction,
+byte) pairs of the ibmpc_atxt decoder: 3-byte standard packets, or
+4-byte ones once the mouse reports ID 3 (IntelliMouse, wheel) or ID 4
+(IntelliMouse Explorer, wheel and buttons 4 and 5) to Get Device ID.
+Usable on its own for offline byte logs:
+
+    from ibmpc_kbd.mouse import decode
+    for ss, es, event in decode(records):
+        ...
+
+Packets are Packet tuples spanning their bytes, host commands, their
+arguments and the replies engine.Event tuples with cs 'mouse'.
+'''
+
+from collections import namedtuple
+from .engine import Anomaly, Event, Kind, error_event
+from .lists import mouse_cmds, mouse_responses, responses
+
+# buttons is a bitmask of the button bits below, dx and dy the signed
+# movement, up positive, wheel the signed wheel movement, overflow X (1)
+# and/or Y (2) for movement out of the 9-bit range.
+Packet = namedtuple('Packet', 'buttons dx dy wheel overflow')
+
+LEFT, RIGHT, MIDDLE, BUTTON4, BUTTON5 = 1, 2, 4, 8, 16
+
+button_names = ((LEFT, 'L'), (MIDDLE, 'M'), (RIGHT, 'R'), (BUTTON4, '4'), (BUTTON5, '5'))
+
+# Packet bytes per device ID.
+packet_sizes = {0x00: 3, 0x03: 4, 0x04: 4}
+
+# Host commands taking an argument byte, and reply bytes after the ACK.
+mouse_cmd_specs = {
+    0xE8: (1, 0),
+    0xE9: (0, 3),
+    0xF2: (0, 1),
+    0xF3: (1, 0),
+    0xFF: (0, 2),
+}
+
+def mouse_event(kind, byte, name, text):
+    return Event(kind, 'mouse', byte, 0, None, name, text, None)
+
+cmd_events = [mouse_event(Kind.CMD, byte, mouse_cmds.get(byte, '???'),
+        ['Cmd: %s' % mouse_cmds.get(byte, '???'), 'C', 'C']) for byte in range(256)]
+response_events = {byte: mouse_event(Kind.RESPONSE, byte, text[1], list(text))
+        for byte, text in mouse_responses.items()}
+sync_errors = [error_event('mouse', byte, Anomaly.SYNC, 'Packet sync %02X' % byte)
+        for byte in range(256)]
+
+def arg_event(cmd, byte):
+    if cmd == 0xF3:
+        text = ['Sample rate: %d/s' % byte, '%d/s' % byte]
+    elif cmd == 0xE8 and byte < 4:
+        text = ['Resolution: %d counts/mm' % (1 << byte), '%d/mm' % (1 << byte)]
+    else:
+        text = ['Arg: %02X' % byte, '%02X' % byte]
+    return mouse_event(Kind.CMD, byte, text[0], text + ['A'])
+
+def reply_event(cmd, n, byte):
+    # Reply byte n, counted from 0, to cmd.
+    if cmd == 0xE9:
+        if n == 0:
+            buttons = ' '.join(name for bit, name in button_names[:3] if byte & bit)
+            text = 'Status: %s, %s, scaling %s%s' % ('remote' if byte & 0x40 else 'stream',
+                    'enabled' if byte & 0x20 else 'disabled', '2:1' if byte & 0x10 else '1:1',
+                    ', ' + buttons if buttons else '')
+        elif n == 1:
+            text = 'Resolution: %d counts/mm' % (1 << (byte & 3))
+        else:
+            text = 'Sample rate: %d/s' % byte
+    elif cmd == 0xFF and n == 0 and byte in responses:
+        text = responses[byte][0]
+    else:
+        text = 'ID: %02X' % byte
+    return mouse_event(Kind.RESPONSE, byte, text, [text, '%02X' % byte, 'R'])
+
+def packet_text(p):
+    buttons = ' '.join(name for bit, name in button_names if p.buttons & bit)
+    text = 'Mouse: %+d %+d' % (p.dx, p.dy)
+    if p.wheel:
+        text += ', wheel %+d' % p.wheel
+    if buttons:
+        text += ', ' + buttons
+    if p.overflow:
+        text += ', overflow %s' % ' '.join(axis for bit, axis in ((1, 'X'), (2, 'Y'))
+                if p.overflow & bit)
+    return [text, '%+d %+d' % (p.dx, p.dy), buttons or 'P']
+
+class Mouse:
+    '''Per-byte PS/2 mouse state machine.
+
+    Packet bytes go into a preallocated buffer. A first packet byte
+    without the always set bit 3 is reported as out of sync and dropped,
+    so the next bytes are taken as a new packet until one lines up. A
+    host byte aborts a partial packet.
+    '''
+
+    def __init__(self):
+        self.buf = bytearray(4)
+        self.n = 0
+        self.id = 0
+        self.size = 3
+        self.cmd = None
+        self.arg = False
+        self.ack = False
+        self.replies = 0
+        self.reply = 0
+
+    def feed(self, direction, byte):
+        '''Advance by one byte, returning the decoded Packet or Event,
+        or None.'''
+        if direction == 'H->D':
+            self.n = 0
+            self.ack = True
+            if self.arg:
+                self.arg = False
+                return arg_event(self.cmd, byte)
+            self.cmd = byte
+            args, self.replies = mouse_cmd_specs.get(byte, (0, 0))
+            self.arg = args > 0
+            self.reply = 0
+            return cmd_events[byte]
+
+        if self.ack:
+            self.ack = False
+            if byte in response_events:
+                if byte != 0xFA:
+                    self.replies = 0
+                return response_events[byte]
+        if self.replies:
+            return self.take_reply(byte)
+
+        n = self.n
+        if not n and not byte & 0x08:
+            return sync_errors[byte]
+        buf = self.buf
+        buf[n] = byte
+        n += 1
+        if n < self.size:
+            self.n = n
+            return None
+        self.n = 0
+        b0 = buf[0]
+        buttons = b0 & 7
+        wheel = 0
+        if n == 4:
+            z = buf[3]
+            if self.id == 4:
+                wheel = (z & 0x0F) - (z << 1 & 0x10)
+                buttons |= z >> 1 & 0x18
+            else:
+                wheel = z - (z << 1 & 0x100)
+        return Packet(buttons, buf[1] - (b0 << 4 & 0x100), buf[2] - (b0 << 3 & 0x100),
+                wheel, b0 >> 6)
+
+    def take_reply(self, byte):
+        n = self.reply
+        self.reply += 1
+        self.replies -= 1
+        if self.cmd == 0xF2 or (self.cmd == 0xFF and n == 1):
+            self.id = byte
+            self.size = packet_sizes.get(byte, 3)
+        return reply_event(self.cmd, n, byte)
+
+def decode(records):
+    '''Decode (ss, es, direction, byte) records of a mouse, yielding
+    (ss, es, event), ss of a Packet being that of its first byte.'''
+    mouse = Mouse()
+    feed = mouse.feed
+    ss0 = 0
+    for ss, es, direction, byte in records:
+        if not mouse.n:
+            ss0 = ss
+        event = feed(direction, byte)
+        if event:
+            yield ss0 if type(event) is Packet else ss, es, event
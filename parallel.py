@@ -0,0 +1,108 @@
+'''
+Chunk-parallel decoding of one large capture
+
+The engine state only carries over a few bytes: any byte that is not a
+prefix or part of a multi-byte sequence leads back to INIT. So a capture
+is split into chunks, each decoded in a worker from every start state in
+lock-step until they converge, normally within a few bytes, and from
+there on once. Following the true end state of each chunk then picks
+the matching start of the next one, which makes the output identical to
+the serial engine:
+
+    from ibmpc_kbd.parallel import decode_parallel
+    for i, event in decode_parallel(host, data, 'cs2'):
+        ...
+
+host holds the direction of each byte (nonzero for H->D), data the byte
+values, both as bytes-like objects. Event i was decoded from byte i;
+the events replayed after a broken sequence error share its i. Workers
+are processes by default; threads only run in parallel on a
+free-threaded Python build.
+'''
+
+from array import array
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import os
+from .engine import State, compile_tables
+
+def decode_chunk(cs, host, data):
+    '''Decode one chunk from every engine state.
+
+    Events are given as (index, slot) arrays, index the byte within the
+    chunk and slot the table slot of the event, or len(table) + byte for
+    host commands. Returns (heads, tail, ends): heads holds the events up
+    to convergence for each start state, tail those after it, and ends
+    the end state for each start state.
+    '''
+    table, _ = compile_tables(cs)
+    ncmd = len(table)
+    nstates = ncmd >> 8
+    states = list(range(nstates))
+    heads = [(array('l'), array('l')) for _ in states]
+    n = len(data)
+    i = 0
+    while i < n:
+        byte = data[i]
+        if host[i]:
+            for index, slots in heads:
+                index.append(i)
+                slots.append(ncmd + byte)
+            states = [State.INIT] * nstates
+        else:
+            for s, state in enumerate(states):
+                slot = state << 8 | byte
+                states[s], event = table[slot]
+                if event:
+                    heads[s][0].append(i)
+                    heads[s][1].append(slot)
+        i += 1
+        if states.count(states[0]) == nstates:
+            break
+    else:
+        return heads, (array('l'), array('l')), states
+
+    # All start states agree from here on. Lists append faster than
+    # arrays, which only serve to pass the result back compactly.
+    index, slots = [], []
+    add_index, add_slot = index.append, slots.append
+    state = states[0]
+    for i, h, byte in zip(range(i, n), host[i:], data[i:]):
+        if h:
+            add_index(i)
+            add_slot(ncmd + byte)
+            state = State.INIT
+            continue
+        slot = state << 8 | byte
+        state, event = table[slot]
+        if event:
+            add_index(i)
+            add_slot(slot)
+    return heads, (array('l', index), array('l', slots)), [state] * nstates
+
+def decode_parallel(host, data, cs='cs2', jobs=None, chunk_size=1 << 20,
+        threads=False, state=State.INIT):
+    '''Decode host and data in chunks across jobs workers, yielding
+    (i, event) exactly as engine.decode() would, the events replayed
+    after a broken sequence error following it.
+
+    state is the engine state before the first byte.
+    '''
+    table, cmds = compile_tables(cs)
+    lookup = [event for _, event in table] + cmds
+    host = memoryview(host).cast('B')
+    data = memoryview(data).cast('B')
+    bounds = range(0, len(data), chunk_size)
+    pool = (ThreadPoolExecutor if threads else ProcessPoolExecutor)(jobs or os.cpu_count())
+    with pool:
+        results = pool.map(decode_chunk, [cs] * len(bounds),
+                (host[i:i + chunk_size].tobytes() for i in bounds),
+                (data[i:i + chunk_size].tobytes() for i in bounds))
+        for base, (heads, tail, ends) in zip(bounds, results):
+            for index, slots in (heads[state], tail):
+                for i, slot in zip(index, slots):
+                    event = lookup[slot]
+                    yield base + i, event
+                    if event.replay:
+                        for replayed in event.replay:
+                            yield base + i, replayed
+            state = ends[state]
@@ -1,14 +1,89 @@
+'''
+OUTPUT_PYTHON format:
+
+Every byte that completes an event is emitted as an engine.Event
+namedtuple: (kind, cs, code, flags, key, name, text, usage, replay). The
+records are prebuilt per code set and shared between puts; treat them as
+read-only.
+
+ - kind: engine.Kind.KEY, CMD (host command), RESPONSE (ACK, BAT) or
+   ERROR (overrun, broken prefix or sequence)
+ - cs: the code set, 'cs1', 'cs2' or 'cs3'
+ - code: raw scan code without prefix or break bit, or the command or
+   response byte
+ - flags: engine.Flag.E0, Flag.E1 and/or Flag.BREAK for keys, the
+   engine.Anomaly for errors, 0 otherwise
+ - key: normalized key id, code | 0x100 for E0 keys, code | 0x200 for
+   E1 keys, None for non-keys
+ - name: key, command or response name
+ - text: the annotation strings
+ - usage: USB HID usage of keys, page << 16 | usage ID (Keyboard page
+   0x07, Consumer 0x0C or Generic Desktop 0x01), 0 if there is none,
+   None for non-keys
+ - replay: for a broken sequence error, the events of the bytes after
+   its first one decoded again, which are emitted right after it; ()
+   otherwise
+
+With option cs=all, each code set is decoded into its own row, with
+only the events, transactions, profile and utilization options. The
+others (typematic, held, timing, text, health, search and summary) need
+a single code set; set to other than their default they are ignored,
+which a Code set annotation on the first byte lists.
+
+With option device=mouse, PS/2 mouse movement packets are emitted as
+mouse.Packet namedtuples (buttons, dx, dy, wheel, overflow), host
+commands, their arguments and replies as Events with cs 'mouse'. The
+keyboard options do not apply then.
+
+OUTPUT_BINARY 'events', with option events=yes:
+
+The same events as export.RECORD structs, little-endian (ss, es, kind,
+code, flags), for conversion to a columnar event file by export.py.
+
+OUTPUT_BINARY 'matches', with option search=FILE:
+
+One search.HIT struct per match of a pattern in FILE, little-endian
+(ss, es, pattern number), see search.py.
+
+Option state=FILE resumes decoding of a capture split into segments:
+the decoder state is restored from FILE at start, if it exists, and
+saved to it at end, before pending runs and held keys are flushed. The
+file holds the state as compressed JSON along with the options it was
+taken with, restoring it with other options is an error. The sample
+numbers of later segments should continue those of earlier ones.
+'''
+
 import sigrokdecode as srd
 from enum import IntEnum
+import json
+import os
+import time
+import zlib
+from .engine import *
+from .stats import Health, Histogram, KeyTiming, Profile, Summary, Utilization
+from .export import RECORD
+from .search import HIT, Matcher, load
+from .mouse import Mouse, Packet, packet_text
 
 class Ann(IntEnum):
     DATA = 0
-
-class State(IntEnum):
-    INIT = 0
-    F0 = 1
-    E0 = 2
-    F0_E0 = 3
+    HELD = 1
+    STUCK = 2
+    PHANTOM = 3
+    ROLLOVER = 4
+    CODE_SET = 5
+    CS1 = 6
+    CS2 = 7
+    CS3 = 8
+    TRANSACTION = 9
+    STATS = 10
+    TEXT = 11
+    ERROR = 12
+    ERROR_RATE = 13
+    MATCH = 14
+    SUMMARY = 15
+    UTILIZATION = 16
+    PACKET = 17
 
 class Decoder(srd.Decoder):
     api_version = 3
@@ -18,607 +93,798 @@ class Decoder(srd.Decoder):
     desc = 'IBM PC AT/XT keyboard/mouse interface.'
     license = 'gplv2+'
     inputs = ['ibmpc_atxt']
-    outputs = []
+    outputs = ['ibmpc_kbd']
     tags = ['PC']
     options = (
-        {'id': 'cs', 'desc': 'Code Set', 'default': 'cs2', 'values': ('cs1', 'cs2', 'cs3')},
+        {'id': 'device', 'desc': 'Device', 'default': 'keyboard',
+            'values': ('keyboard', 'mouse')},
+        {'id': 'cs', 'desc': 'Code Set', 'default': 'cs2',
+            'values': ('cs1', 'cs2', 'cs3', 'auto', 'all')},
+        {'id': 'typematic', 'desc': 'Typematic repeats', 'default': 'each',
+            'values': ('each', 'coalesce')},
+        {'id': 'held', 'desc': 'Track held keys', 'default': 'no',
+            'values': ('yes', 'no')},
+        {'id': 'transactions', 'desc': 'Track host command exchanges', 'default': 'no',
+            'values': ('yes', 'no')},
+        {'id': 'timing', 'desc': 'Keystroke timing statistics', 'default': 'no',
+            'values': ('yes', 'no')},
+        {'id': 'events', 'desc': 'Binary event records', 'default': 'no',
+            'values': ('yes', 'no')},
+        {'id': 'profile', 'desc': 'Profiling counters', 'default': 'no',
+            'values': ('yes', 'no')},
+        {'id': 'text', 'desc': 'Reconstruct typed text', 'default': 'no',
+            'values': ('yes', 'no')},
+        {'id': 'health', 'desc': 'Protocol health monitor', 'default': 'no',
+            'values': ('yes', 'no')},
+        {'id': 'state', 'desc': 'State file to resume from and save to', 'default': ''},
+        {'id': 'search', 'desc': 'Pattern file to search for', 'default': ''},
+        {'id': 'summary', 'desc': 'Overview row window', 'default': 'no',
+            'values': ('no', 'auto', '10ms', '100ms', '1s', '10s', '1min')},
+        {'id': 'maps', 'desc': 'Vendor scan code map file', 'default': ''},
+        {'id': 'utilization', 'desc': 'Bus utilization window', 'default': 'no',
+            'values': ('no', '10ms', '100ms', '1s', '10s', '1min')},
     )
     annotations = (
         ('data', 'Data'),
+        ('held', 'Held keys'),
+        ('stuck', 'Stuck key'),
+        ('phantom', 'Phantom break'),
+        ('rollover', 'Rollover'),
+        ('code-set', 'Code set'),
+        ('cs1', 'Code Set 1'),
+        ('cs2', 'Code Set 2'),
+        ('cs3', 'Code Set 3'),
+        ('transaction', 'Transaction'),
+        ('stats', 'Statistics'),
+        ('text', 'Typed text'),
+        ('error', 'Protocol error'),
+        ('error-rate', 'Error rate'),
+        ('match', 'Pattern match'),
+        ('summary', 'Summary'),
+        ('utilization', 'Bus utilization'),
+        ('packet', 'Mouse packet'),
+    )
+    binary = (
+        ('events', 'Decoded events'),
+        ('matches', 'Pattern matches'),
     )
     annotation_rows = (
         ('code', 'Code', (0,)),
+        ('keys', 'Held keys', (Ann.HELD,)),
+        ('key-warnings', 'Key warnings', (Ann.STUCK, Ann.PHANTOM, Ann.ROLLOVER)),
+        ('code-set', 'Code set', (Ann.CODE_SET,)),
+        ('code-cs1', 'Code Set 1', (Ann.CS1,)),
+        ('code-cs2', 'Code Set 2', (Ann.CS2,)),
+        ('code-cs3', 'Code Set 3', (Ann.CS3,)),
+        ('transactions', 'Transactions', (Ann.TRANSACTION,)),
+        ('stats', 'Statistics', (Ann.STATS,)),
+        ('typed', 'Typed text', (Ann.TEXT,)),
+        ('health', 'Protocol health', (Ann.ERROR, Ann.ERROR_RATE)),
+        ('matches', 'Matches', (Ann.MATCH,)),
+        ('summary', 'Summary', (Ann.SUMMARY,)),
+        ('utilization', 'Bus utilization', (Ann.UTILIZATION,)),
+        ('mouse', 'Mouse', (Ann.PACKET,)),
     )
 
+    # Options the saved state depends on, a snapshot taken with other
+    # values is refused.
+    snapshot_options = ('device', 'cs', 'typematic', 'held', 'transactions', 'timing',
+            'text', 'health', 'search', 'summary', 'maps', 'utilization', 'profile')
+    # State fields of the helper objects, by decoder attribute, and of
+    # the decoder itself. Objects the options leave out are skipped, and
+    # so are fields not set yet.
+    snapshot_fields = {
+        'detector': ('nbytes', 'nrepeats', 'votes', 'prev', 'select', 'makes'),
+        'mouse': ('buf', 'n', 'id', 'size', 'cmd', 'arg', 'ack', 'replies', 'reply'),
+        'held': ('bits', 'since', 'held', 'max'),
+        'transactions': ('cmd', 'ss', 'es', 'nargs', 'nreplies', 'args', 'replies',
+                'latencies', 'resends', 'resend', 'unacked'),
+        'latency': ('buckets', 'count', 'total', 'min', 'max'),
+        'timing': ('hold', 'interval', 'delay', 'repeat', 'presses', 'down', 'last',
+                'events', 'last_press', 'made', 'pending', 'first', 'last_ss'),
+        'typed': ('mods', 'caps', 'num', 'locks_held'),
+        'health': ('window', 'counts', 'state', 'first', 'last', 'window_ss',
+                'window_errors', 'window_bytes', 'windows', 'bad_windows', 'peak'),
+        'matcher': ('labels', 'ring', 'count', 'node', 'last', 'counts'),
+        'summary': ('window', 'gap', 'limit', 'counts', 'n', 'ss', 'es'),
+        'utilization': ('window', 'bytes', 'busy', 'window_ss', 'window_bytes',
+                'window_busy', 'window_burst', 'carry', 'windows', 'peak_bytes',
+                'peak_busy', 'bursts', 'burst', 'prev', 'first', 'last'),
+        'profile': ('bytes', 'states', 'unknown', 'anns', 'time', 'first', 'last'),
+    }
+    snapshot_attrs = ('buffered', 'packet_ss', 'repeat', 'repeat_ss', 'repeat_es',
+            'repeat_count', 'repeat_ss2', 'repeat_last', 'chord_ss', 'chord_text',
+            'last_es', 'resends', 'latency_span', 'line', 'line_ss', 'line_es',
+            'match_span')
+    snapshot_version = 3
+
+    # Options that need a single code set, ignored with cs=all.
+    single_cs_options = ('typematic', 'held', 'timing', 'text', 'health', 'search',
+            'summary')
+
+    # Summary and utilization row windows in seconds, None for adaptive ones.
+    windows = {'auto': None, '10ms': 0.01, '100ms': 0.1, '1s': 1,
+            '10s': 10, '1min': 60}
+
     def __init__(self):
         self.reset()
 
     def reset(self):
-        self.state = State.INIT
+        self.engine = None
+        self.samplerate = None
+        self.repeat = None
+
+    def metadata(self, key, value):
+        if key == srd.SRD_CONF_SAMPLERATE:
+            self.samplerate = value
 
     def start(self):
         self.out_ann = self.register(srd.OUTPUT_ANN)
+        self.out_python = self.register(srd.OUTPUT_PYTHON)
+        self.out_binary = self.register(srd.OUTPUT_BINARY)
+        self.pack = RECORD.pack if self.options['events'] == 'yes' else None
+        self.overlay = self.options['maps'] or None
+        self.detector = None
+        self.multi = None
+        self.mouse = None
+        if self.options['device'] == 'mouse':
+            # Keyboard options do not apply.
+            self.mouse = Mouse()
+            self.packet_ss = None
+        elif self.options['cs'] == 'all':
+            # Every code set at once, each with its own state and row.
+            self.multi = [(Engine(cs, self.overlay).feed, ann) for cs, ann in
+                    (('cs1', Ann.CS1), ('cs2', Ann.CS2), ('cs3', Ann.CS3))]
+            defaults = {o['id']: o['default'] for o in Decoder.options}
+            self.ignored = [name for name in self.single_cs_options
+                    if self.options[name] != defaults[name]]
+        elif self.options['cs'] == 'auto':
+            self.detector = Detector()
+            self.buffered = []
+        else:
+            self.set_cs(self.options['cs'])
+        self.coalesce = self.options['typematic'] == 'coalesce'
+        self.held = HeldKeys() if self.options['held'] == 'yes' else None
+        self.chord_ss, self.chord_text = None, ''
+        self.last_es = 0
+        self.transactions = None
+        if self.options['transactions'] == 'yes':
+            self.transactions = Transactions()
+            self.latency = Histogram()
+            self.resends = 0
+            self.latency_span = None
+        self.timing = KeyTiming() if self.options['timing'] == 'yes' else None
+        self.typed = TypedText() if self.options['text'] == 'yes' else None
+        self.line, self.line_ss, self.line_es = [], None, None
+        self.health = None
+        if self.options['health'] == 'yes' and not self.multi:
+            # The window is set from the samplerate on the first byte.
+            self.health = Health(None)
+        self.matcher = None
+        if self.options['search'] and not self.multi:
+            self.matcher = Matcher(load(self.options['search']), self.overlay)
+            self.match_span = None
+        self.summary = None
+        if self.options['summary'] != 'no' and not self.multi:
+            # Sized from the samplerate on the first event.
+            self.summary = Summary(None)
+        self.utilization = None
+        if self.options['utilization'] != 'no':
+            # Sized from the samplerate on the first byte.
+            self.utilization = Utilization(None)
+        self.profile = None
+        if self.options['profile'] == 'yes':
+            self.start_profile()
+        if self.options['state'] and os.path.exists(self.options['state']):
+            with open(self.options['state'], 'rb') as f:
+                self.restore(f.read())
+
+    def snapshot(self):
+        '''The decoder state as compressed JSON for restore().'''
+        state = {'version': self.snapshot_version,
+                'options': {name: self.options[name] for name in self.snapshot_options}}
+        if self.engine:
+            state['engine'] = [self.engine.cs, int(self.engine.state)]
+        if self.multi:
+            state['multi'] = [int(feed.__self__.state) for feed, _ in self.multi]
+        for name, fields in self.snapshot_fields.items():
+            obj = getattr(self, name, None)
+            if obj is not None:
+                state[name] = self.dump_fields(obj, fields)
+        state['decoder'] = self.dump_fields(self, self.snapshot_attrs)
+        return zlib.compress(json.dumps(state, separators=(',', ':')).encode())
+
+    def dump_fields(self, obj, fields):
+        return {name: self.dump_value(getattr(obj, name)) for name in fields
+                if hasattr(obj, name)}
+
+    def dump_value(self, value):
+        # Events by index into the prebuilt ones of their code set.
+        if type(value) is Event:
+            return {'event': [value.cs, event_index(value)]}
+        if type(value) is Histogram:
+            return self.dump_fields(value, self.snapshot_fields['latency'])
+        if isinstance(value, (list, tuple, set, bytearray)):
+            return [self.dump_value(v) for v in value]
+        if isinstance(value, dict):
+            return {k: self.dump_value(v) for k, v in value.items()}
+        return value
+
+    def restore(self, data):
+        '''Continue from a snapshot() of a decoder with the same options.
+
+        Call after start(). Sample numbers held in the state, such as
+        when keys went down, keep referring to the earlier timebase.
+        Raises ValueError for a snapshot of another version or taken
+        with other options.
+        '''
+        state = json.loads(zlib.decompress(data))
+        if state.get('version') != self.snapshot_version:
+            raise ValueError('Unsupported snapshot version %r' % state.get('version'))
+        for name, value in state['options'].items():
+            if self.options[name] != value:
+                raise ValueError('Snapshot taken with %s=%s, not %s' % (name, value,
+                        self.options[name]))
+        if self.matcher and state['matcher']['labels'] != self.matcher.labels:
+            raise ValueError('Snapshot taken with other search patterns')
+        if 'engine' in state:
+            cs, engine_state = state['engine']
+            if self.detector:
+                self.detector = self.buffered = None
+            self.set_cs(cs)
+            self.engine.state = engine_state
+        if self.multi:
+            for (feed, _), engine_state in zip(self.multi, state['multi']):
+                feed.__self__.state = engine_state
+        for name, fields in self.snapshot_fields.items():
+            obj = getattr(self, name, None)
+            if obj is not None and name in state:
+                self.load_fields(obj, state[name])
+        self.load_fields(self, state['decoder'])
+
+    def load_fields(self, obj, fields):
+        for name, value in fields.items():
+            setattr(obj, name, self.load_value(getattr(obj, name, None), value))
+
+    def load_value(self, current, value):
+        if type(current) is Histogram:
+            self.load_fields(current, value)
+            return current
+        if isinstance(value, dict) and 'event' in value:
+            cs, index = value['event']
+            return event_at(cs, self.overlay, index)
+        if type(current) in (bytearray, set):
+            return type(current)(value)
+        if isinstance(value, list):
+            return [self.load_value(None, v) for v in value]
+        if isinstance(value, dict):
+            return {k: self.load_value(None, v) for k, v in value.items()}
+        return value
+
+    def start_profile(self):
+        # Shadow decode() and put() with counting wrappers, which leaves
+        # them untouched with profiling off.
+        self.profile = Profile()
+        self.decode = self.decode_profiled
+        self.put = self.put_profiled
+        self.out_meta = {}
+        for name, kind, desc in [
+                ('Bytes H->D', int, 'Bytes sent by the host'),
+                ('Bytes D->H', int, 'Bytes sent by the device')] + [
+                ('State %s' % name, int, 'Device bytes decoded in state %s' % name)
+                for name in self.profile_states] + [
+                ('Unknown %s' % cs, int, "Unknown '???' codes in %s" % cs)
+                for cs in code_sets] + [
+                ('Annotations', int, 'Annotations put'),
+                ('Decode time', float, 'Seconds spent in decode()')]:
+            self.out_meta[name] = self.register(srd.OUTPUT_META, meta=(kind, name, desc))
+
+    def set_cs(self, cs):
+        self.engine = Engine(cs, self.overlay)
+        self.feed = self.engine.feed
+
+    def detect(self, ss, es, data):
+        # Buffer the stream until the code set is known.
+        self.buffered.append((ss, es, data))
+        cs = self.detector.feed(*data)
+        if cs:
+            self.commit_cs(cs)
+
+    def commit_cs(self, cs):
+        # Decode the buffered start of the stream with the detected set.
+        buffered, self.buffered = self.buffered, None
+        self.detector = None
+        self.set_cs(cs)
+        self.put(buffered[0][0], buffered[-1][1], self.out_ann, [Ann.CODE_SET,
+                ['Code Set %s (detected)' % cs[2], 'CS%s' % cs[2], cs[2]]])
+        # Bypasses the profiling wrapper, the records were counted on arrival.
+        for record in buffered:
+            Decoder.decode(self, *record)
 
     def decode(self, ss, es, data):
-        direction, byte = data
-
-        if direction == 'H->D':
-            self.put(ss, es, self.out_ann, [Ann.DATA, ['Cmd: %s' % self.to_cmd(byte), 'C', 'C']])
-            self.state = State.INIT
-            return;
-
-        if self.state == State.INIT:
-            if byte == 0xF0:
-                self.state = State.F0
-            elif byte == 0xE0:
-                self.state = State.E0
-            elif byte == 0xAA and self.options['cs'] in ['cs2', 'cs3']:
-                self.state = State.INIT
-                self.put(ss, es, self.out_ann, [Ann.DATA, ['BAT OK', 'OK', 'OK']])
-            elif byte == 0xFC and self.options['cs'] in ['cs2', 'cs3']:
-                self.state = State.INIT
-                self.put(ss, es, self.out_ann, [Ann.DATA, ['BAT NG', 'NG', 'NG']])
-            elif byte == 0xFA:
-                self.state = State.INIT
-                self.put(ss, es, self.out_ann, [Ann.DATA, ['Res: ACK', 'ACK', 'A']])
-            else:
-                self.state = State.INIT
-                if self.options['cs'] == 'cs1':
-                    if byte & 0x80:
-                        self.put(ss, es, self.out_ann, [Ann.DATA,
-                                ['↑: %s' % self.to_code(byte & 0x7F), '↑', '↑']])
-                    else:
-                        self.put(ss, es, self.out_ann, [Ann.DATA,
-                                ['↓: %s' % self.to_code(byte & 0x7F), '↓', '↓']])
-                else:
-                    self.put(ss, es, self.out_ann, [Ann.DATA,
-                            ['↓: %s' % self.to_code(byte), '↓', '↓']])
-
-        elif self.state == State.F0:
-            if byte == 0xE0:
-                self.state = State.F0_E0
-            else:
-                self.state = State.INIT
-                self.put(ss, es, self.out_ann, [Ann.DATA,
-                        ['↑: %s' % self.to_code(byte), '↑', '↑']])
-
-        elif self.state == State.E0:
-            self.state = State.INIT
-            self.put(ss, es, self.out_ann, [Ann.DATA,
-                    ['↓: %s' % self.to_e0_code(byte), '↓', '↓']])
-
-        elif self.state == State.F0_E0:
-            self.state = State.INIT
-            self.put(ss, es, self.out_ann, [Ann.DATA,
-                    ['↑: %s' % self.to_e0_code(byte), '↑', '↑']])
+        if self.detector:
+            self.detect(ss, es, data)
+            return
+        if self.utilization:
+            self.update_utilization(ss, es, data[0])
+        if self.mouse:
+            self.decode_mouse(ss, es, data)
+            return
+        if self.transactions:
+            t = self.transactions.feed(ss, es, *data)
+            if t:
+                self.put_transaction(t)
+        if self.multi:
+            self.decode_multi(ss, es, data)
+            return
+
+        event = self.feed(*data)
+        if self.health:
+            self.check_health(ss, es, data, event)
+        if not event:
+            return
+        self.put_event(ss, es, event)
+        if event.replay:
+            for replayed in event.replay:
+                self.put_event(ss, es, replayed)
+
+    def put_event(self, ss, es, event):
+        self.put(ss, es, self.out_python, event)
+        if self.pack:
+            self.put(ss, es, self.out_binary, [0, self.pack(ss, es, event.kind,
+                    event.code, event.flags)])
+        if self.held:
+            self.update_held(ss, es, event)
+        if self.timing and event.key is not None:
+            self.timing.add(ss, event)
+        if self.typed and event.key is not None:
+            self.update_text(ss, es, event)
+        if self.matcher:
+            for p, start in self.matcher.feed(ss, event):
+                self.put_match(p, start, es)
+        if self.summary:
+            s = self.summary
+            if s.window is None and s.gap is None:
+                self.size_summary(s)
+            elif s.due(ss):
+                self.put_summary()
+            s.add(ss, es, event)
+
+        if self.coalesce:
+            if event is self.repeat:
+                if self.repeat_count == 1:
+                    self.repeat_ss2 = ss
+                self.repeat_last = ss
+                self.repeat_es = es
+                self.repeat_count += 1
+                return
+            self.put_repeat()
+            if event.key is not None and not event.flags & BREAK:
+                # Hold back makes until a different event ends the run.
+                self.repeat = event
+                self.repeat_ss, self.repeat_es = ss, es
+                self.repeat_count = 1
+                return
+
+        self.put(ss, es, self.out_ann, [Ann.ERROR if event.kind == ERROR else Ann.DATA,
+                event.text])
 
+    def decode_profiled(self, ss, es, data):
+        p = self.profile
+        if p.first is None:
+            p.first = ss
+        p.last = es
+        p.bytes[data[0]] += 1
+        if data[0] == 'D->H':
+            if self.multi:
+                for feed, _ in self.multi:
+                    p.state(feed.__self__.cs, feed.__self__.state)
+            elif self.engine:
+                p.state(self.engine.cs, self.engine.state)
+        t0 = time.perf_counter()
+        Decoder.decode(self, ss, es, data)
+        p.time += time.perf_counter() - t0
 
+    def put_profiled(self, ss, es, output_id, data):
+        if output_id == self.out_ann:
+            self.profile.anns += 1
+        elif (output_id == self.out_python and type(data) is not Packet and
+                data.name == '???' and data.cs in self.profile.unknown):
+            self.profile.unknown[data.cs] += 1
+        srd.Decoder.put(self, ss, es, output_id, data)
+
+    def decode_multi(self, ss, es, data):
+        if self.ignored:
+            self.put(ss, es, self.out_ann, [Ann.CODE_SET,
+                    ['Ignored with all code sets: %s' % ', '.join(self.ignored),
+                    'Ignored: %s' % ', '.join(self.ignored), 'I']])
+            self.ignored = None
+        for feed, ann in self.multi:
+            event = feed(*data)
+            if not event:
+                continue
+            for event in (event,) + event.replay:
+                self.put(ss, es, self.out_python, event)
+                if self.pack:
+                    self.put(ss, es, self.out_binary, [0, self.pack(ss, es,
+                            event.kind, event.code, event.flags)])
+                self.put(ss, es, self.out_ann, [ann, event.text])
+
+    def decode_mouse(self, ss, es, data):
+        if not self.mouse.n:
+            self.packet_ss = ss
+        event = self.mouse.feed(*data)
+        if not event:
+            return
+        if type(event) is Packet:
+            self.put(self.packet_ss, es, self.out_python, event)
+            self.put(self.packet_ss, es, self.out_ann, [Ann.PACKET, packet_text(event)])
+            return
+        self.put(ss, es, self.out_python, event)
+        self.put(ss, es, self.out_ann, [Ann.ERROR if event.kind == ERROR else Ann.DATA,
+                event.text])
+
+    def end(self):
+        if self.options['state']:
+            # Saved before end of capture flushes pending runs.
+            with open(self.options['state'], 'wb') as f:
+                f.write(self.snapshot())
+        if self.detector:
+            # Capture shorter than the detection look-ahead.
+            if not self.buffered:
+                return
+            self.commit_cs(self.detector.result())
+        self.put_repeat()
+        if self.held:
+            self.put_stuck(self.last_es)
+            self.put_chord(self.last_es)
+        if self.transactions:
+            t = self.transactions.finish()
+            if t:
+                self.put_transaction(t)
+            self.put_latency()
+        if self.timing:
+            self.put_timing()
+        if self.typed:
+            self.put_line()
+        if self.health:
+            self.put_health()
+        if self.matcher:
+            self.put_matches()
+        if self.summary:
+            self.put_summary()
+        if self.utilization:
+            self.put_bus_stats()
+        if self.profile:
+            self.put_profile()
+
+    def update_held(self, ss, es, event):
+        held = self.held
+        self.last_es = es
+        if event.key is None:
+            if event.code == 0xAA and event.kind == Kind.RESPONSE:
+                # Keyboard reset, keys still held never got their break.
+                self.put_stuck(ss)
+                held.clear()
+                self.put_chord(ss)
+            return
+        if event.flags & BREAK:
+            if not held.release(event):
+                self.put(ss, es, self.out_ann, [Ann.PHANTOM,
+                        ['Phantom break: %s' % event.name, 'Phantom', 'P']])
+                return
+        elif event.flags & E1:
+            # Pause has no break of its own.
+            return
+        else:
+            nmax = held.max
+            if not held.press(event, ss):
+                return
+            if held.max > nmax > 0:
+                self.put(ss, es, self.out_ann, [Ann.ROLLOVER,
+                        ['Rollover: %d keys' % held.max, '%d keys' % held.max]])
+        self.put_chord(ss)
+
+    # Annotations of anomalies found by Health, errors from the engine
+    # tables are annotated as events.
+    anomaly_text = {
+        Anomaly.UNKNOWN: ['Unknown code %02X', 'Unknown', 'U'],
+        Anomaly.DANGLING: ['Prefix pending at host command', 'Dangling', 'D'],
+    }
+
+    def check_health(self, ss, es, data, event):
+        h = self.health
+        if h.window is None:
+            h.window = self.samplerate or 1000000
+        elif ss >= h.window_ss + h.window:
+            self.put_error_rate()
+            h.next_window(ss)
+        anomaly = h.feed(ss, data[0], data[1], event, self.engine.state)
+        if anomaly in self.anomaly_text:
+            text = self.anomaly_text[anomaly]
+            if anomaly == Anomaly.UNKNOWN:
+                text = [text[0] % event.code] + text[1:]
+            self.put(ss, es, self.out_ann, [Ann.ERROR, text])
+
+    def put_error_rate(self):
+        h = self.health
+        if h.window_errors:
+            self.put(h.window_ss, h.window_ss + h.window, self.out_ann, [Ann.ERROR_RATE,
+                    ['%d errors in %s, %.1f%% of bytes' % (h.window_errors,
+                    self.time_str(h.window), 100 * h.window_errors / h.window_bytes),
+                    '%d errors' % h.window_errors]])
+
+    def put_health(self):
+        h = self.health
+        if h.first is None:
+            return
+        self.put_error_rate()
+        h.next_window(None)
+        total = sum(h.counts)
+        self.put(h.first, h.last, self.out_ann, [Ann.STATS,
+                ['Health: %d anomalies (%s), %d of %d windows with errors, peak %d per %s' %
+                (total, ', '.join('%d %s' % (n, anomaly.name.lower())
+                for anomaly, n in zip(Anomaly, h.counts)), h.bad_windows, h.windows,
+                h.peak, self.time_str(h.window)), 'Health: %d anomalies' % total]])
+
+    def put_match(self, p, ss, es):
+        self.match_span = ((self.match_span or (ss,))[0], es)
+        label = self.matcher.labels[p]
+        self.put(ss, es, self.out_ann, [Ann.MATCH, ['Match: %s' % label, label, 'M']])
+        self.put(ss, es, self.out_binary, [1, HIT.pack(ss, es, p)])
+
+    def put_matches(self):
+        # Matches per pattern over the whole capture.
+        m = self.matcher
+        if self.match_span is None:
+            return
+        self.put(*self.match_span, self.out_ann, [Ann.STATS,
+                ['Matches: %s' % ', '.join('%s ×%d' % match
+                for match in zip(m.labels, m.counts)), 'Matches']])
+
+    def size_summary(self, s):
+        # Fixed windows, or adaptive ones of up to 1000 events split at
+        # idle gaps of over a second.
+        samplerate = self.samplerate or 1000000
+        window = self.windows[self.options['summary']]
+        if window:
+            s.window = int(window * samplerate)
+        else:
+            s.gap, s.limit = samplerate, 1000
+
+    def put_summary(self):
+        s = self.summary
+        if s.ss is None:
+            return
+        keys, cmds, responses, errors = s.counts
+        self.put(s.ss, s.es, self.out_ann, [Ann.SUMMARY,
+                ['%d keys, %d cmds, %d responses, %d errors' % (keys, cmds,
+                responses, errors), '%d keys' % keys, str(keys)]])
+        s.clear()
+
+    def update_utilization(self, ss, es, direction):
+        u = self.utilization
+        if u.window is None:
+            u.window = int(self.windows[self.options['utilization']] *
+                    (self.samplerate or 1000000))
+        elif ss >= u.window_ss + u.window:
+            self.put_utilization()
+            u.next_window(ss)
+        u.feed(ss, es, direction)
+
+    def rate_str(self, n, samples):
+        if not self.samplerate:
+            return '%d per %s' % (n, self.time_str(samples))
+        return '%.0f/s' % (n * self.samplerate / samples)
+
+    def put_utilization(self, last=False):
+        # The last window ends with the capture, rates are over its length.
+        u = self.utilization
+        es = u.window_ss + u.window
+        if last:
+            es = min(es, u.last)
+        length = max(es - u.window_ss, 1)
+        busy = sum(u.window_busy.values())
+        text = '%s H->D, %s D->H, %.1f%% busy' % (
+                self.rate_str(u.window_bytes['H->D'], length),
+                self.rate_str(u.window_bytes['D->H'], length), 100 * busy / length)
+        if busy:
+            text += ', %.0f%% device' % (100 * u.window_busy['D->H'] / busy)
+        text += ', burst %d' % u.window_burst
+        self.put(u.window_ss, es, self.out_ann, [Ann.UTILIZATION,
+                [text, '%.1f%%' % (100 * busy / length)]])
+
+    def put_bus_stats(self):
+        # Utilization aggregates over the whole capture.
+        u = self.utilization
+        if u.first is None:
+            return
+        self.put_utilization(last=True)
+        u.finish()
+        span = max(u.last - u.first, 1)
+        busy = sum(u.busy.values())
+        b = u.bursts
+        text = 'Utilization: %d bytes H->D (%s), %d D->H (%s), %.1f%% busy, %.0f%% device' % (
+                u.bytes['H->D'], self.rate_str(u.bytes['H->D'], span), u.bytes['D->H'],
+                self.rate_str(u.bytes['D->H'], span), 100 * busy / span,
+                100 * u.busy['D->H'] / busy if busy else 0)
+        if u.windows:
+            # Over full windows only, a partial one would skew the peak.
+            text += '; peak window %s, %.1f%% busy' % (self.rate_str(u.peak_bytes, u.window),
+                    100 * u.peak_busy / u.window)
+        text += '; bursts n %d, mean %.1f, p99 %d, max %d bytes' % (b.count, b.mean(),
+                b.quantile(0.99), b.max)
+        self.put(u.first, u.last, self.out_ann, [Ann.STATS,
+                [text, 'Utilization %.1f%%' % (100 * busy / span)]])
+
+    def update_text(self, ss, es, event):
+        char = self.typed.feed(event)
+        if char is None:
+            return
+        if self.line_ss is None:
+            self.line_ss = ss
+        self.line_es = es
+        if char == '\b':
+            if self.line:
+                self.line.pop()
+        elif char == '\n':
+            self.put_line('⏎')
+        else:
+            self.line.append('⇥' if char == '\t' else char)
+
+    def put_line(self, end=''):
+        # One annotation per line of typed text.
+        if self.line_ss is None:
+            return
+        text = ''.join(self.line) + end
+        self.put(self.line_ss, self.line_es, self.out_ann, [Ann.TEXT,
+                ['Typed: %s' % text, text]])
+        self.line, self.line_ss = [], None
+
+    def put_chord(self, ss):
+        # Close the annotation of the previous held set at ss, start a new one.
+        if self.chord_text:
+            self.put(self.chord_ss, ss, self.out_ann, [Ann.HELD, [self.chord_text]])
+        self.chord_ss = ss
+        self.chord_text = ' + '.join(event.name for event in self.held.held)
+
+    def put_stuck(self, es):
+        for event in self.held.held:
+            self.put(self.held.since[event.key], es, self.out_ann, [Ann.STUCK,
+                    ['Stuck: %s' % event.name, 'Stuck', 'S']])
+
+    def time_str(self, samples):
+        if not self.samplerate:
+            return '%d samples' % samples
+        t = samples / self.samplerate
+        if t < 0.001:
+            return '%.0fµs' % (t * 1000000)
+        if t < 1:
+            return '%.1fms' % (t * 1000)
+        return '%.1fs' % t
+
+    def histogram_str(self, h):
+        return 'n %d, min %s, mean %s, p50 %s, p99 %s, max %s' % (h.count,
+                self.time_str(h.min), self.time_str(h.mean()),
+                self.time_str(h.quantile(0.5)), self.time_str(h.quantile(0.99)),
+                self.time_str(h.max))
+
+    def put_transaction(self, t):
+        self.latency_span = ((self.latency_span or (t.ss,))[0], t.es)
+        for latency in t.latencies:
+            self.latency.add(latency)
+        self.resends += t.resends
+        text = transaction_str(t)
+        if t.latencies:
+            text += ', ACK %s' % self.time_str(t.latencies[0])
+        elif t.cmd != 0xEE:
+            text += ', no ACK'
+        if t.resends:
+            text += ', %d resends' % t.resends
+        self.put(t.ss, t.es, self.out_ann, [Ann.TRANSACTION,
+                [text, cmds.get(t.cmd, '???'), 'T']])
+
+    def put_latency(self):
+        # ACK latency aggregates over the whole capture.
+        h = self.latency
+        if not h.count:
+            return
+        self.put(*self.latency_span, self.out_ann, [Ann.STATS,
+                ['ACK latency: %s, %d resends' % (self.histogram_str(h), self.resends),
+                'ACK latency']])
+
+    def put_timing(self):
+        # Keystroke timing summary over the whole capture.
+        t = self.timing
+        if t.first is None:
+            return
+        span = t.first, t.last_ss
+        for name, h in (('Hold', t.hold), ('Interval', t.interval),
+                ('Typematic delay', t.delay), ('Typematic period', t.repeat)):
+            if h.count:
+                self.put(*span, self.out_ann, [Ann.STATS,
+                        ['%s: %s' % (name, self.histogram_str(h)), name]])
+        if t.repeat.count and self.samplerate:
+            rate = self.samplerate / t.repeat.mean()
+            self.put(*span, self.out_ann, [Ann.STATS,
+                    ['Typematic rate: %.1f/s' % rate, 'Rate']])
+        top = ', '.join('%s ×%d' % (event.name, n) for event, n in t.top(10))
+        self.put(*span, self.out_ann, [Ann.STATS,
+                ['Most pressed: %s' % top, 'Most pressed']])
+
+    # Profile.states slots, the engine states and then all sequence states.
+    profile_states = [state.name for state in State] + ['SEQUENCE']
+
+    def put_profile(self):
+        # Counters on the meta outputs, then a summary on the stats row.
+        p = self.profile
+        if p.first is None:
+            return
+        span = p.first, p.last
+        values = {'Bytes H->D': p.bytes['H->D'], 'Bytes D->H': p.bytes['D->H'],
+                'Annotations': p.anns, 'Decode time': p.time}
+        for i, name in enumerate(self.profile_states):
+            values['State %s' % name] = sum(counts[i] for counts in p.states.values())
+        for cs, n in p.unknown.items():
+            values['Unknown %s' % cs] = n
+        for name, value in values.items():
+            self.put(*span, self.out_meta[name], value)
+
+        nbytes = p.bytes['H->D'] + p.bytes['D->H']
+        self.put(*span, self.out_ann, [Ann.STATS,
+                ['Profile: %d bytes (%d H->D, %d D->H), %d annotations, '
+                '%.3fs in decode, %.2fµs/byte' % (nbytes, p.bytes['H->D'],
+                p.bytes['D->H'], p.anns, p.time, p.time * 1000000 / nbytes),
+                'Profile']])
+        for cs, counts in p.states.items():
+            if any(counts) or p.unknown[cs]:
+                self.put(*span, self.out_ann, [Ann.STATS,
+                        ['States %s: %s, %d unknown' % (cs, ', '.join('%s %d' % s
+                        for s in zip(self.profile_states, counts)), p.unknown[cs]),
+                        'States %s' % cs]])
+
+    def put_repeat(self):
+        # Emit a pending run of identical makes as one annotation from the
+        # first make's ss to the last one's es. The rate is measured over
+        # the repeats only, leaving out the typematic delay.
+        event = self.repeat
+        if not event:
+            return
+        self.repeat = None
+        count = self.repeat_count
+        if count == 1:
+            self.put(self.repeat_ss, self.repeat_es, self.out_ann, [Ann.DATA, event.text])
+            return
+        text = '%s ×%d' % (event.text[0], count)
+        if count > 2 and self.samplerate:
+            rate = (count - 2) * self.samplerate / (self.repeat_last - self.repeat_ss2)
+            text += ' (%.1f/s)' % rate
+        self.put(self.repeat_ss, self.repeat_es, self.out_ann, [Ann.DATA,
+                [text, '%s ×%d' % (event.text[1], count), event.text[2]]])
 
     def to_code(self, byte):
-        if self.options['cs'] == 'cs1':
-            return self.cs1_to_str(byte)
-        elif self.options['cs'] == 'cs2':
-            return self.cs2_to_str(byte)
-        elif self.options['cs'] == 'cs3':
-            return self.cs3_to_str(byte)
+        return code_set(self.engine.cs, self.overlay).codes.get(byte, '???')
 
     def to_e0_code(self, byte):
-        if self.options['cs'] == 'cs1':
-            return self.cs1_e0_to_str(byte)
-        elif self.options['cs'] == 'cs2':
-            return self.cs1_e0_to_str(byte)
-        elif self.options['cs'] == 'cs3':
-            return '???'
+        return code_set(self.engine.cs, self.overlay).e0.get(byte, '???')
 
     def to_cmd(self, byte):
-        try:
-            return {
-                0xED: 'Set Indicator',
-                0xEE: 'Echo',
-                0xF0: 'Select Scan Code',
-                0xF2: 'Read ID',
-                0xF4: 'Enable',
-                0xF5: 'Default Disable',
-                0xF6: 'Set Default',
-                0xF7: 'Set All Keys - Typematic',
-                0xF8: 'Set All Keys - Make/Break',
-                0xF9: 'Set All Keys - Make',
-                0xFA: 'Set All Keys - Typematic/Make/Break',
-                0xFB: 'Set Key Type - Typematic',
-                0xFC: 'Set Key Type - Make/Break',
-                0xFD: 'Set Key Type - Make',
-                0xFE: 'Resend',
-                0xFF: 'Reset',
-            }[byte]
-        except:
-            return '???'
+        return cmds.get(byte, '???')
+
+    def cs3_e0_to_str(self, byte):
+        return code_set('cs3', self.overlay).e0.get(byte, '???')
 
     def cs3_to_str(self, byte):
-        try:
-            return {
-                0x01:   'LGui',
-                0x03:   'Vol Down',
-                0x04:   'Vol Up',
-                0x05:   'Mute',
-                0x06:   'HENKAN',
-                0x07:   'F1',
-                0x08:   'F13',
-                0x09:   'RGui',
-                0x0A:   'App',
-                0x0B:   'MHENKAN',
-                0x0C:   'Pause',
-                0x0D:   'Tab',
-                0x0E:   '`',
-                0x0F:   'F2',
-                0x10:   'F14',
-                0x11:   'Ctrl',
-                0x12:   'LShift',
-                0x13:   'ISO \\',
-                0x14:   'CapsL',
-                0x15:   'Q',
-                0x16:   '1',
-                0x17:   'F3',
-                0x18:   'F15',
-                0x19:   'Alt',
-                0x1A:   'Z',
-                0x1B:   'S',
-                0x1C:   'A',
-                0x1D:   'W',
-                0x1E:   '2',
-                0x1F:   'F4',
-                0x20:   'F16',
-                0x21:   'C',
-                0x22:   'X',
-                0x23:   'D',
-                0x24:   'E',
-                0x25:   '4',
-                0x26:   '3',
-                0x27:   'F5',
-                0x28:   'F17',
-                0x29:   'Space',
-                0x2A:   'V',
-                0x2B:   'F',
-                0x2C:   'T',
-                0x2D:   'R',
-                0x2E:   '5',
-                0x2F:   'F6',
-                0x30:   'F18',
-                0x31:   'N',
-                0x32:   'B',
-                0x33:   'H',
-                0x34:   'G',
-                0x35:   'Y',
-                0x36:   '6',
-                0x37:   'F7',
-                0x38:   'F19',
-                0x39:   'Alt',
-                0x3A:   'M',
-                0x3B:   'J',
-                0x3C:   'U',
-                0x3D:   '7',
-                0x3E:   '8',
-                0x3F:   'F8',
-                0x40:   'F20',
-                0x41:   ',',
-                0x42:   'K',
-                0x43:   'I',
-                0x44:   'O',
-                0x45:   '0',
-                0x46:   '9',
-                0x47:   'F9',
-                0x48:   'F21',
-                0x49:   ',',
-                0x4A:   '/',
-                0x4B:   'L',
-                0x4C:   ';',
-                0x4D:   'P',
-                0x4E:   '-',
-                0x4F:   'F10',
-                0x50:   'F22',
-                0x51:   'RO',
-                0x52:   '\'',
-                0x53:   'ISO #',
-                0x54:   '[',
-                0x55:   '=',
-                0x56:   'F11',
-                0x57:   'F23',
-                0x58:   'Ctrl',
-                0x59:   'RShift',
-                0x5A:   'Ret',
-                0x5B:   ']',
-                0x5C:   '\\',
-                0x5D:   'JPY',
-                0x5E:   'F12',
-                0x5F:   'F24',
-                0x60:   'Down',
-                0x61:   'Left',
-                0x62:   'Home',
-                0x63:   'Up',
-                0x64:   'End',
-                0x65:   'Insert',
-                0x66:   'BS',
-                0x67:   '/',
-                0x68:   ',',
-                0x69:   '1',
-                0x6A:   'Rig',
-                0x6B:   'P4',
-                0x6C:   'P7',
-                0x6D:   'Delete',
-                0x6E:   'Page Up',
-                0x6F:   'Page Down',
-                0x70:   'P0',
-                0x71:   'P.',
-                0x72:   'P2',
-                0x73:   'P5',
-                0x74:   'P6',
-                0x75:   'P8',
-                0x76:   'Esc',
-                0x77:   'Num Lock',
-                0x78:   'P=',
-                0x79:   'Enter',
-                0x7A:   'P3',
-                0x7B:   'P-',
-                0x7C:   'P+',
-                0x7D:   'P9',
-                0x7E:   'Scroll Lock',
-                0x83:   'Print Screen',
-                0x84:   'P*',
-                0x85:   'P,',
-                0x86:   'P=',
-                0x87:   'KANA',
-            }[byte]
-        except:
-            return '???'
+        return code_set('cs3', self.overlay).codes.get(byte, '???')
 
     def cs2_e0_to_str(self, byte):
-        try:
-            return {
-                0x10:   'WWW Search',
-                0x11:   'Right Alt',
-                0x14:   'Right Control',
-                0x15:   'Scan Previous Track',
-                0x18:   'WWW Favorites',
-                0x1F:   'Left GUI',
-                0x20:   'WWW Refresh',
-                0x21:   'Volume Down',
-                0x23:   'Mute',
-                0x27:   'Right GUI',
-                0x28:   'WWW Stop',
-                0x2B:   'Calculator',
-                0x2F:   'App',
-                0x30:   'WWW Forward',
-                0x32:   'Volume Up',
-                0x34:   'Play/ Pause',
-                0x37:   'Keyboard Power',
-                0x37:   'System Power',
-                0x38:   'WWW Back',
-                0x3A:   'WWW Home',
-                0x3B:   'Stop',
-                0x3F:   'System Sleep',
-                0x40:   'My Computer',
-                0x48:   'Mail',
-                0x4A:   'Keypad /',
-                0x4D:   'Scan Next Track',
-                0x50:   'Media Select',
-                0x5A:   'Keypad Enter',
-                0x5E:   'System Wake',
-                0x69:   'End',
-                0x6B:   'Left Arrow',
-                0x6C:   'Home',
-                0x70:   'Insert',
-                0x71:   'Delete',
-                0x72:   'Down Arrow',
-                0x74:   'Right Arrow',
-                0x75:   'Up Arrow',
-                0x7A:   'Page Down',
-                0x7C:   'Print Screen',
-                0x7D:   'Page Up',
-                0x7E:   'Break (Ctrl-Pause)',
-            }[byte]
-        except:
-            return '???'
+        return code_set('cs2', self.overlay).e0.get(byte, '???')
 
     def cs2_to_str(self, byte):
-        try:
-            return {
-                0x00:   'Overrun Error',
-                0x01:   'F9',
-                0x03:   'F5',
-                0x04:   'F3',
-                0x05:   'F1',
-                0x06:   'F2',
-                0x07:   'F12',
-                0x08:   'F13',
-                0x09:   'F10',
-                0x0A:   'F8',
-                0x0B:   'F6',
-                0x0C:   'F4',
-                0x0D:   'Tab',
-                0x0E:   '` ~',
-                0x0F:   'Keypad =',
-                0x10:   'F14',
-                0x11:   'Left Alt',
-                0x12:   'Left Shift',
-                0x13:   'Katakana/Hiragana',
-                0x14:   'Left Control',
-                0x15:   'q Q',
-                0x16:   '1 !',
-                0x18:   'F15',
-                0x1A:   'z Z',
-                0x1B:   's S',
-                0x1C:   'a A',
-                0x1D:   'w W',
-                0x1E:   '2 @',
-                0x20:   'F16',
-                0x21:   'c C',
-                0x22:   'x X',
-                0x23:   'd D',
-                0x24:   'e E',
-                0x25:   '4 $',
-                0x26:   '3 #',
-                0x27:   'PC9800 Keypad ,',
-                0x28:   'F17',
-                0x29:   'Space',
-                0x2A:   'v V',
-                0x2B:   'f F',
-                0x2C:   't T',
-                0x2D:   'r R',
-                0x2E:   '5 %',
-                0x30:   'F18',
-                0x31:   'n N',
-                0x32:   'b B',
-                0x33:   'h H',
-                0x34:   'g G',
-                0x35:   'y Y',
-                0x36:   '6 ^',
-                0x38:   'F19',
-                0x3A:   'm M',
-                0x3B:   'j J',
-                0x3C:   'u U',
-                0x3D:   '7 &',
-                0x3E:   '8 *',
-                0x40:   'F20',
-                0x41:   ', <',
-                0x42:   'k K',
-                0x43:   'i I',
-                0x44:   'o O',
-                0x45:   '0 )',
-                0x46:   '9 (',
-                0x48:   'F21',
-                0x49:   '. >',
-                0x4A:   '/ ?',
-                0x4B:   'l L',
-                0x4C:   '; :',
-                0x4D:   'p P',
-                0x4E:   '- _',
-                0x50:   'F22',
-                0x51:   'ろ',
-                0x52:   '\' "',
-                0x54:   '[ {',
-                0x55:   '= +',
-                0x57:   'F23',
-                0x58:   'Caps Lock',
-                0x59:   'Right Shift',
-                0x5A:   'Return',
-                0x5B:   '] }',
-                0x5D:   '\\',
-                0x5F:   'F24',
-                0x5F:   '半角/全角',
-                0x61:   'Europe 2',
-                0x62:   'ひらがな',
-                0x63:   'かたかな',
-                0x64:   '変換',
-                0x66:   'Backspace',
-                0x67:   '無変変',
-                0x69:   'Keypad 1 End',
-                0x6A:   '¥(Yen)',
-                0x6B:   'Keypad 4 Left',
-                0x6C:   'Keypad 7 Home',
-                0x6D:   'Keypad ,',
-                0x70:   'Keypad 0 Insert',
-                0x71:   'Keypad . Delete',
-                0x72:   'Keypad 2 Down',
-                0x73:   'Keypad 5',
-                0x74:   'Keypad 6 Right',
-                0x75:   'Keypad 8 Up',
-                0x76:   'Escape',
-                0x77:   'Num Lock',
-                0x78:   'F11',
-                0x79:   'Keypad +',
-                0x7A:   'Keypad 3 PageDn',
-                0x7B:   'Keypad -',
-                0x7C:   'Keypad *',
-                0x7D:   'Keypad 9 PageUp',
-                0x7E:   'Scroll Lock',
-                0x83:   'F7',
-                0xF1:   '한한(Hanja)',
-                0xF2:   '한옝(Hangul/English)',
-                0xFC:   'POST Fail',
-            }[byte]
-        except:
-            return '???'
+        return code_set('cs2', self.overlay).codes.get(byte, '???')
 
     def cs1_e0_to_str(self, byte):
-        try:
-            return {
-                0x10: 'Scan Previous Track',
-                0x19: 'Scan Next Track',
-                0x1C: 'Keypad Enter',
-                0x1D: 'Right Control',
-                0x20: 'Mute',
-                0x21: 'Calculator',
-                0x22: 'Play/ Pause',
-                0x24: 'Stop',
-                0x2E: 'Volume Down',
-                0x30: 'Volume Up',
-                0x32: 'WWW Home',
-                0x35: 'Keypad /',
-                0x37: 'Prinen',
-                0x38: 'Right Alt',
-                0x46: 'Break (Ctrl-Pause)',
-                0x47: 'Home',
-                0x48: 'Up Arrow',
-                0x49: 'Page Up',
-                0x4B: 'Left Arrow',
-                0x4D: 'Right Arrow',
-                0x4F: 'End',
-                0x50: 'Down Arrow',
-                0x51: 'Page Down',
-                0x52: 'Insert',
-                0x53: 'Delete',
-                0x5B: 'Left GUI',
-                0x5C: 'Right GUI',
-                0x5D: 'App',
-                0x5E: 'Keyboard Power',
-                0x5E: 'System Power',
-                0x5F: 'System Sleep',
-                0x63: 'System Wake',
-                0x65: 'WWW Search',
-                0x66: 'WWW Favorites',
-                0x67: 'WWW Refresh',
-                0x68: 'WWW Stop',
-                0x69: 'WWW Forward',
-                0x6A: 'WWW Back',
-                0x6B: 'My Computer',
-                0x6C: 'Mail',
-                0x6D: 'Media Select',
-            }[byte]
-        except:
-            return '???'
+        return code_set('cs1', self.overlay).e0.get(byte, '???')
 
     def cs1_to_str(self, byte):
-        try:
-            return {
-                0x01:   'Escape',
-                0x02:   '1',
-                0x03:   '2',
-                0x04:   '3',
-                0x05:   '4',
-                0x06:   '5',
-                0x07:   '6',
-                0x08:   '7',
-                0x09:   '8',
-                0x0A:   '9',
-                0x0B:   '0',
-                0x0C:   '- _',
-                0x0D:   '= +',
-                0x0E:   'Backspace',
-                0x0F:   'Tab',
-                0x10:   'q',
-                0x11:   'w',
-                0x12:   'e',
-                0x13:   'r',
-                0x14:   't',
-                0x15:   'y',
-                0x16:   'u',
-                0x17:   'i',
-                0x18:   'o',
-                0x19:   'p',
-                0x1A:   '[ {',
-                0x1B:   '] }',
-                0x1C:   'Return',
-                0x1D:   'Left Control',
-                0x1E:   'a',
-                0x1F:   's',
-                0x20:   'd',
-                0x21:   'f',
-                0x22:   'g',
-                0x23:   'h',
-                0x24:   'j',
-                0x25:   'k',
-                0x26:   'l',
-                0x27:   '; :',
-                0x28:   '\' "',
-                0x29:   '` ~',
-                0x2A:   'Left Shift',
-                0x2B:   '\\',
-                0x2C:   'z',
-                0x2D:   'x',
-                0x2E:   'c',
-                0x2F:   'v',
-                0x30:   'b',
-                0x31:   'n',
-                0x32:   'm',
-                0x33:   ', <',
-                0x34:   '. >',
-                0x35:   '/ ?',
-                0x36:   'Right Shift',
-                0x37:   'Keypad *',
-                0x38:   'Left Alt',
-                0x39:   'Space',
-                0x3A:   'Caps Lock',
-                0x3B:   'F1',
-                0x3C:   'F2',
-                0x3D:   'F3',
-                0x3E:   'F4',
-                0x3F:   'F5',
-                0x40:   'F6',
-                0x41:   'F7',
-                0x42:   'F8',
-                0x43:   'F9',
-                0x44:   'F10',
-                0x45:   'Num Lock',
-                0x46:   'Scroll Lock',
-                0x47:   'Keypad 7 Home',
-                0x48:   'Keypad 8 Up',
-                0x49:   'Keypad 9 PageUp',
-                0x4A:   'Keypad -',
-                0x4B:   'Keypad 4 Left',
-                0x4C:   'Keypad 5',
-                0x4D:   'Keypad 6 Right',
-                0x4E:   'Keypad +',
-                0x4F:   'Keypad 1 End',
-                0x50:   'Keypad 2 Down',
-                0x51:   'Keypad 3 PageDn',
-                0x52:   'Keypad 0 Insert',
-                0x53:   'Keypad . Delete',
-                0x54:   'Unknown',
-                0x55:   'Unknown',
-                0x56:   'Europe 2',
-                0x57:   'F11',
-                0x58:   'F12',
-                0x59:   'Keypad =',
-                0x5A:   'Unknown',
-                0x5B:   'Unknown',
-                0x5C:   'PC9800 Keypad ,',
-                0x5D:   'Unknown',
-                0x5E:   'Unknown',
-                0x5F:   'Unknown',
-                0x60:   'Unknown',
-                0x61:   'Unknown',
-                0x62:   'Unknown',
-                0x63:   'Unknown',
-                0x64:   'F13',
-                0x65:   'F14',
-                0x66:   'F15',
-                0x67:   'F16',
-                0x68:   'F17',
-                0x69:   'F18',
-                0x6A:   'F19',
-                0x6B:   'F20',
-                0x6C:   'F21',
-                0x6D:   'F22',
-                0x6E:   'F23',
-                0x6F:   'Unknown',
-                0x70:   'Katakana/Hiragana',
-                0x71:   'Unknown',
-                0x72:   'Unknown',
-                0x73:   'ろ (Ro)',
-                0x74:   'Unknown',
-                0x75:   'Unknown',
-                0x76:   'F24 半角/全角',
-                0x77:   'ひらがな',
-                0x78:   'かたかな',
-                0x79:   '変換',
-                0x7A:   'Unknown',
-                0x7B:   '無変変',
-                0x7C:   'Unknown',
-                0x7D:   '¥ (Yen)',
-                0x7E:   'Keypad ,',
-                0x7F:   'Unknown',
-                0xAA:   'BAT OK',
-                0xFC:   'BAT NG',
-                0xFF:   'Overrun Error',
-            }[byte]
-        except:
-            return '???'
+        return code_set('cs1', self.overlay).codes.get(byte, '???')
@@ -0,0 +1,149 @@
+'''
+Offline decoding of a directory of ibmpc_atxt byte logs
+
+Decodes every log in a directory with the engine, one file per worker
+process, and writes the decoded events of each log plus a merged
+summary:
+
+    python3 -m ibmpc_kbd.runner LOGDIR -o OUTDIR [-c CS] [-j JOBS]
+
+Logs hold one (ss, es, direction, byte) record per byte:
+
+ - .csv: ss,es,dir,byte lines
+ - .bin: little-endian BIN_RECORD structs, dir 1 for H->D, 0 for D->H
+ - anything else: ss es dir byte lines, whitespace separated
+
+In text logs dir is H->D or D->H and byte is hex, with or without 0x.
+Blank lines, '#' comments and a header line are skipped.
+
+OUTDIR/<log>.txt gets one 'ss es annotation' line per event,
+OUTDIR/summary.csv a row of counts per log and a total row. A log that
+fails to read is summarized up to the error, which goes in its row.
+'''
+
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import csv
+import os
+import struct
+import time
+from .engine import Kind, BREAK, decode
+
+BIN_RECORD = struct.Struct('<QQBB')
+
+directions = {'H->D': 'H->D', 'D->H': 'D->H', 'H': 'H->D', 'D': 'D->H'}
+
+# Summary columns after the file name and code set.
+fields = ('bytes', 'host', 'events', 'makes', 'breaks', 'cmds', 'responses',
+        'unknown', 'errors', 'seconds')
+
+def parse_fields(fields):
+    ss, es, direction, byte = fields
+    byte = int(byte, 16)
+    if not 0 <= byte <= 0xFF:
+        raise ValueError('byte out of range')
+    return int(ss), int(es), directions[direction], byte
+
+def read_text(f, split):
+    header = True
+    for n, line in enumerate(f, 1):
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        try:
+            yield parse_fields(split(line))
+        except (ValueError, KeyError):
+            if not header:
+                raise ValueError('line %d: bad record %r' % (n, line))
+        header = False
+
+def read_bin(f):
+    size = BIN_RECORD.size
+    while True:
+        chunk = f.read(size * 4096)
+        for ss, es, host, byte in BIN_RECORD.iter_unpack(chunk[:len(chunk) - len(chunk) % size]):
+            yield ss, es, 'H->D' if host else 'D->H', byte
+        if len(chunk) < size * 4096:
+            break
+
+def read_log(path):
+    '''Records of a byte log, read lazily.'''
+    ext = os.path.splitext(path)[1].lower()
+    if ext == '.bin':
+        with open(path, 'rb') as f:
+            yield from read_bin(f)
+    else:
+        split = str.split
+        if ext == '.csv':
+            split = lambda line: [field.strip() for field in line.split(',')]
+        with open(path) as f:
+            yield from read_text(f, split)
+
+def count_bytes(records, counts):
+    for record in records:
+        counts['bytes'] += 1
+        if record[2] == 'H->D':
+            counts['host'] += 1
+        yield record
+
+def run_file(path, outdir, cs):
+    '''Decode one log into outdir, returning its summary row.'''
+    t0 = time.perf_counter()
+    counts = dict.fromkeys(fields, 0)
+    row = {'file': os.path.basename(path), 'cs': cs, 'error': ''}
+    try:
+        with open(os.path.join(outdir, row['file'] + '.txt'), 'w') as out:
+            for ss, es, event in decode(count_bytes(read_log(path), counts), cs):
+                counts['events'] += 1
+                if event.kind == Kind.KEY:
+                    counts['breaks' if event.flags & BREAK else 'makes'] += 1
+                    if event.name == '???':
+                        counts['unknown'] += 1
+                elif event.kind == Kind.CMD:
+                    counts['cmds'] += 1
+                elif event.kind == Kind.RESPONSE:
+                    counts['responses'] += 1
+                else:
+                    counts['errors'] += 1
+                row['cs'] = event.cs
+                out.write('%d %d %s\n' % (ss, es, event.text[0]))
+    except (OSError, ValueError) as e:
+        row['error'] = str(e)
+    counts['seconds'] = round(time.perf_counter() - t0, 3)
+    row.update(counts)
+    return row
+
+def run(logdir, outdir, cs='cs2', jobs=None):
+    '''Decode all logs in logdir across jobs processes, returning the
+    summary rows and writing them to outdir/summary.csv.'''
+    paths = sorted(os.path.join(logdir, name) for name in os.listdir(logdir)
+            if os.path.isfile(os.path.join(logdir, name)))
+    os.makedirs(outdir, exist_ok=True)
+    with ProcessPoolExecutor(jobs) as pool:
+        rows = list(pool.map(run_file, paths, [outdir] * len(paths), [cs] * len(paths)))
+    total = dict((f, sum(row[f] for row in rows)) for f in fields)
+    total.update(file='total', cs='', seconds=round(total['seconds'], 3),
+            error='%d failed' % sum(1 for row in rows if row['error']))
+    with open(os.path.join(outdir, 'summary.csv'), 'w', newline='') as f:
+        w = csv.DictWriter(f, ('file', 'cs') + fields + ('error',))
+        w.writeheader()
+        w.writerows(rows + [total])
+    return rows, total
+
+def main():
+    parser = argparse.ArgumentParser(description='Decode a directory of ibmpc_atxt byte logs')
+    parser.add_argument('logdir')
+    parser.add_argument('-o', '--outdir', required=True)
+    parser.add_argument('-c', '--cs', default='cs2', choices=('cs1', 'cs2', 'cs3', 'auto'))
+    parser.add_argument('-j', '--jobs', type=int, help='worker processes (default: all cores)')
+    args = parser.parse_args()
+    t0 = time.perf_counter()
+    rows, total = run(args.logdir, args.outdir, args.cs, args.jobs)
+    print('%-24s %-4s' % ('file', 'cs') + ''.join('%10s' % f for f in fields))
+    for row in rows + [total]:
+        print('%-24s %-4s' % (row['file'][:24], row['cs']) +
+                ''.join('%10s' % row[f] for f in fields) + '  ' + row['error'])
+    print('%d files in %.1fs' % (len(rows), time.perf_counter() - t0))
+
+if __name__ == '__main__':
+    main()
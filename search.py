@@ -0,0 +1,220 @@
+'''
+Multi-pattern search over decoded events
+
+Finds every occurrence of a list of event patterns in one pass with an
+Aho-Corasick automaton, so the work per event does not grow with the
+number of patterns. A pattern file has one pattern per line:
+
+    # label = items
+    ctrl-alt-del = "+Left Control" "+Left Alt" "+Keypad . Delete"
+    leds-resend = ">Set Indicator" <FE
+
+Items are shell-quoted, each a prefix and a name:
+
+ - +NAME or NAME: make of a key, by its name in the scan code maps
+ - -NAME: break of a key
+ - >NAME or >XX: host command, by name or hex byte
+ - <NAME or <XX: device response (ACK, OK, NG) or unknown code, by
+   name or hex byte
+ - !NAME: protocol error, by engine.Anomaly name (overrun, prefix)
+
+Names are case-insensitive. Typematic repeats count as one make, so a
+held key does not break a pattern. A line without a label is labeled
+with its items.
+
+With option search=FILE the decoder annotates each match and puts it as
+a HIT struct, little-endian (ss, es, pattern number), on the 'matches'
+binary output. Offline:
+
+    from ibmpc_kbd.search import load, search
+    hits = search(records, load('patterns.txt'), 'cs2')
+
+gives an array of the ss of every match per label, or from the shell,
+for logs as read by runner.py:
+
+    python3 -m ibmpc_kbd.search PATTERNS LOG... [-c CS]
+'''
+
+import argparse
+from array import array
+from collections import deque
+import shlex
+import struct
+from .engine import (BREAK, ERROR, Anomaly, Kind, cmds, code_set, code_sets,
+        decode, responses)
+
+# One match on the decoder's 'matches' binary output.
+HIT = struct.Struct('<QQH')
+
+cmd_names = {name.lower(): byte for byte, name in cmds.items()}
+response_names = {text[1].lower(): byte for byte, text in responses.items()}
+
+def key_names(overlay=None):
+    return {name.lower() for cs in code_sets
+            for table in code_set(cs, overlay)[:3] for name in table.values()}
+
+def parse_item(item, names):
+    '''The symbol of a pattern item, as symbol() gives it for events.'''
+    prefix, name = item[:1], item[1:]
+    if prefix not in ('+', '-', '>', '<', '!'):
+        prefix, name = '+', item
+    name = name.lower()
+    if prefix in ('+', '-'):
+        if name not in names:
+            raise ValueError('Unknown key %r' % item)
+        return prefix, name
+    if prefix == '!':
+        if name.upper() not in Anomaly.__members__:
+            raise ValueError('Unknown error %r' % item)
+        return prefix, Anomaly[name.upper()]
+    names = cmd_names if prefix == '>' else response_names
+    if name in names:
+        return prefix, names[name]
+    try:
+        byte = int(name, 16)
+    except ValueError:
+        byte = -1
+    if not 0 <= byte <= 0xFF:
+        raise ValueError('Bad pattern item %r' % item)
+    return prefix, byte
+
+def symbol(event):
+    '''The symbol of an event, None if no pattern item can match it.'''
+    kind = event.kind
+    if kind == Kind.KEY:
+        if event.name != '???':
+            return '-' if event.flags & BREAK else '+', event.name.lower()
+        if not event.flags:
+            return '<', event.code
+        return None
+    if kind == Kind.CMD:
+        return '>', event.code
+    if kind == ERROR:
+        return '!', event.flags
+    return '<', event.code
+
+def parse(lines):
+    '''Patterns as (label, items) from pattern file lines.'''
+    patterns = []
+    for n, line in enumerate(lines, 1):
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        try:
+            items = shlex.split(line)
+        except ValueError as e:
+            raise ValueError('line %d: %s' % (n, e))
+        label = line
+        if len(items) > 1 and items[1] == '=':
+            label, items = items[0], items[2:]
+        if not items:
+            raise ValueError('line %d: empty pattern' % n)
+        patterns.append((label, items))
+    return patterns
+
+def load(path):
+    with open(path) as f:
+        return parse(f)
+
+class Matcher:
+    '''Aho-Corasick automaton over event symbols.
+
+    feed() steps one state per event through a precomputed transition
+    dict per state and returns the (pattern, ss) of each pattern ending
+    there, ss being that of its first event. The ss of the last events
+    are kept in a ring as long as the longest pattern, so memory does
+    not grow with the stream. counts holds the matches per pattern.
+    Key names may come from the vendor map file overlay.
+    '''
+
+    def __init__(self, patterns, overlay=None):
+        names = key_names(overlay)
+        self.labels = [label for label, _ in patterns]
+        self.lengths = [len(items) for _, items in patterns]
+        self.symbols = {}
+        goto, out = [{}], [[]]
+        for p, (_, items) in enumerate(patterns):
+            node = 0
+            for item in items:
+                sym = self.symbols.setdefault(parse_item(item, names), len(self.symbols))
+                if sym not in goto[node]:
+                    goto[node][sym] = len(goto)
+                    goto.append({})
+                    out.append([])
+                node = goto[node][sym]
+            out[node].append(p)
+
+        # Breadth first, so the failure state of a node and its
+        # transitions are final by the time the node is reached. Missing
+        # transitions lead to the root.
+        fail = [0] * len(goto)
+        self.delta = [dict(edges) for edges in goto]
+        queue = deque(goto[0].values())
+        while queue:
+            node = queue.popleft()
+            out[node] += out[fail[node]]
+            for sym, target in self.delta[fail[node]].items():
+                self.delta[node].setdefault(sym, target)
+            for sym, child in goto[node].items():
+                fail[child] = self.delta[fail[node]].get(sym, 0)
+                queue.append(child)
+        self.out = [tuple(matches) for matches in out]
+
+        self.ring = [0] * max(self.lengths, default=1)
+        self.count = 0
+        self.node = 0
+        self.last = None
+        self.counts = [0] * len(patterns)
+        self.ids = {}
+
+    def feed(self, ss, event):
+        sym = self.ids.get(id(event))
+        if sym is None:
+            sym = self.ids[id(event)] = self.symbols.get(symbol(event), -1)
+        if event is self.last:
+            # Typematic repeat.
+            return ()
+        self.last = event if event.key is not None and not event.flags & BREAK else None
+        ring = self.ring
+        self.count += 1
+        ring[self.count % len(ring)] = ss
+        self.node = node = self.delta[self.node].get(sym, 0)
+        matches = self.out[node]
+        if not matches:
+            return ()
+        for p in matches:
+            self.counts[p] += 1
+        return [(p, ring[(self.count - self.lengths[p] + 1) % len(ring)]) for p in matches]
+
+def search(records, patterns, cs='cs2', overlay=None):
+    '''Decode (ss, es, direction, byte) records and find patterns in
+    them, returning an array of the ss of each match per label.'''
+    m = Matcher(patterns, overlay)
+    hits = [array('Q') for _ in patterns]
+    feed = m.feed
+    for ss, es, event in decode(records, cs, overlay):
+        for p, start in feed(ss, event):
+            hits[p].append(start)
+    return dict(zip(m.labels, hits))
+
+def main():
+    from .runner import read_log
+    parser = argparse.ArgumentParser(description='Find event patterns in ibmpc_atxt byte logs')
+    parser.add_argument('patterns', help='pattern file')
+    parser.add_argument('logs', nargs='+')
+    parser.add_argument('-c', '--cs', default='cs2', choices=('cs1', 'cs2', 'cs3', 'auto'))
+    args = parser.parse_args()
+    patterns = load(args.patterns)
+    for path in args.logs:
+        m = Matcher(patterns)
+        try:
+            for ss, es, event in decode(read_log(path), args.cs):
+                for p, start in m.feed(ss, event):
+                    print('%s %d %d %s' % (path, start, es, m.labels[p]))
+        except (OSError, ValueError) as e:
+            print('%s: %s' % (path, e))
+        print('%s: %s' % (path, ', '.join('%s ×%d' % match
+                for match in zip(m.labels, m.counts))))
+
+if __name__ == '__main__':
+    main()
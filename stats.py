@@ -0,0 +1,323 @@
+'''
+Bounded-memory streaming statistics
+'''
+
+from .engine import BREAK, E1, ERROR, Anomaly, Kind, State, code_sets
+
+class Histogram:
+    '''Count, min, mean, max and quantiles of non-negative integers.
+
+    Values go into a fixed set of log-scale buckets, four per octave, so
+    memory does not grow with the number of values and quantiles are
+    accurate to within 25%. Values below 8 are exact.
+    '''
+
+    def __init__(self):
+        self.buckets = [0] * 256
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+
+    def add(self, value):
+        if value < 4:
+            i = value
+        else:
+            e = value.bit_length() - 1
+            i = (e - 1) << 2 | (value >> (e - 2)) & 3
+        self.buckets[i] += 1
+        self.count += 1
+        self.total += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def mean(self):
+        return self.total / self.count if self.count else None
+
+    def quantile(self, q):
+        '''Upper bound of the bucket holding the q quantile, at most max.'''
+        if not self.count:
+            return None
+        rank = max(1, -(-self.count * q // 1))
+        seen = 0
+        for i, n in enumerate(self.buckets):
+            seen += n
+            if seen >= rank:
+                break
+        if i < 4:
+            return i
+        e, m = (i >> 2) + 1, i & 3
+        return min(((5 + m) << (e - 2)) - 1, self.max)
+
+class KeyTiming:
+    '''Keystroke timing from make and break events, in samples.
+
+    hold is make to break, interval is between new key presses, delay
+    is the first make to the first typematic repeat and repeat the time
+    between further repeats. presses counts new presses per key id,
+    events holds the last make event per key id. The first make of the
+    capture may be a repeat of a key held since before it, so it counts
+    as a press only once a break follows it instead of another make.
+    '''
+
+    def __init__(self):
+        self.hold = Histogram()
+        self.interval = Histogram()
+        self.delay = Histogram()
+        self.repeat = Histogram()
+        self.presses = [0] * 0x300
+        self.down = [None] * 0x300
+        self.last = [None] * 0x300
+        self.events = [None] * 0x300
+        self.last_press = None
+        self.made = False
+        self.pending = None
+        self.first = None
+        self.last_ss = None
+
+    def add(self, ss, event):
+        key = event.key
+        if self.first is None:
+            self.first = ss
+        self.last_ss = ss
+        if event.flags & BREAK:
+            down = self.down[key]
+            if down is not None:
+                if key == self.pending:
+                    # The first make was a press after all.
+                    self.pending = None
+                    self.presses[key] += 1
+                    if self.last_press is None:
+                        self.last_press = down
+                self.hold.add(ss - down)
+                self.down[key] = None
+            return
+        last = self.last[key]
+        made, self.made = self.made, True
+        if not made and not event.flags & E1:
+            # Press or repeat, told apart by the key's next event.
+            self.pending = key
+            self.events[key] = event
+            self.down[key] = ss
+        elif key == self.pending:
+            # Repeat of a key held since before the capture.
+            self.pending = None
+            self.repeat.add(ss - last)
+        elif self.down[key] is None or event.flags & E1:
+            self.presses[key] += 1
+            self.events[key] = event
+            if self.last_press is not None:
+                self.interval.add(ss - self.last_press)
+            self.last_press = ss
+            if not event.flags & E1:
+                self.down[key] = ss
+        elif last == self.down[key]:
+            self.delay.add(ss - last)
+        else:
+            self.repeat.add(ss - last)
+        self.last[key] = ss
+
+    def top(self, n):
+        '''Make events of the n most pressed keys with their press counts.'''
+        keys = sorted(range(len(self.presses)), key=self.presses.__getitem__,
+                reverse=True)[:n]
+        return [(self.events[key], self.presses[key]) for key in keys if self.presses[key]]
+
+class Profile:
+    '''Hot-path counters of the decoder.
+
+    bytes counts bytes per direction, states the device bytes consumed in
+    each engine state per code set, with all trie states of multi-byte
+    sequences counted in the last slot. unknown counts '???' key events
+    per code set, anns the annotations put and time the seconds spent
+    in decode().
+    '''
+
+    def __init__(self):
+        self.bytes = {'H->D': 0, 'D->H': 0}
+        self.states = {cs: [0] * (len(State) + 1) for cs in code_sets}
+        self.unknown = dict.fromkeys(code_sets, 0)
+        self.anns = 0
+        self.time = 0.0
+        self.first = None
+        self.last = None
+
+    def state(self, cs, state):
+        self.states[cs][min(state, len(State))] += 1
+
+class Health:
+    '''Protocol anomalies per category and per fixed time window.
+
+    Errors the engine tables resync from (overruns, broken prefixes and
+    sequences) come as error events. Unknown codes and prefixes left
+    pending when the host takes the bus are classified here, from the
+    engine state after each byte. Memory is constant: one counter per
+    category plus the open window.
+    '''
+
+    def __init__(self, window):
+        self.window = window
+        self.counts = [0] * len(Anomaly)
+        self.state = State.INIT
+        self.first = None
+        self.last = None
+        self.window_ss = None
+        self.window_errors = 0
+        self.window_bytes = 0
+        self.windows = 0
+        self.bad_windows = 0
+        self.peak = 0
+
+    def feed(self, ss, direction, byte, event, state):
+        '''Classify one byte, given its event and the engine state after
+        it, returning its Anomaly or None.'''
+        if self.first is None:
+            self.first = self.window_ss = ss
+        self.last = ss
+        self.window_bytes += 1
+        anomaly = None
+        if direction == 'H->D':
+            if self.state != State.INIT:
+                anomaly = Anomaly.DANGLING
+        elif event is not None:
+            if event.kind == ERROR:
+                anomaly = Anomaly(event.flags)
+            elif event.kind == Kind.KEY and event.name == '???':
+                anomaly = Anomaly.UNKNOWN
+        self.state = state
+        if anomaly is not None:
+            self.counts[anomaly] += 1
+            self.window_errors += 1
+        return anomaly
+
+    def next_window(self, ss):
+        '''Close the open window and start one at ss.'''
+        self.windows += 1
+        if self.window_errors:
+            self.bad_windows += 1
+            self.peak = max(self.peak, self.window_errors)
+        self.window_ss = ss
+        self.window_errors = 0
+        self.window_bytes = 0
+
+class Summary:
+    '''Event counts per window, for an overview row.
+
+    A window starts at its first event and closes at the first event
+    window samples later or, with window None, at the first event after
+    limit events or an idle gap of more than gap samples. counts holds
+    key makes, commands, responses and errors by Kind.
+    '''
+
+    def __init__(self, window, gap=None, limit=None):
+        self.window = window
+        self.gap = gap
+        self.limit = limit
+        self.counts = [0] * len(Kind)
+        self.n = 0
+        self.ss = None
+        self.es = None
+
+    def due(self, ss):
+        '''Whether the open window closes before an event at ss.'''
+        if self.ss is None:
+            return False
+        if self.window:
+            return ss >= self.ss + self.window
+        return self.n >= self.limit or ss - self.es > self.gap
+
+    def add(self, ss, es, event):
+        if self.ss is None:
+            self.ss = ss
+        self.es = es
+        self.n += 1
+        if not event.flags & BREAK or event.kind != Kind.KEY:
+            self.counts[event.kind] += 1
+
+    def clear(self):
+        self.counts = [0] * len(Kind)
+        self.n = 0
+        self.ss = None
+
+class Utilization:
+    '''Bus time and bytes per direction, per fixed window and in total.
+
+    A byte occupies the bus from its ss to its es, bus time of a byte
+    running past the end of a window counts towards the next one. Bytes
+    less than a byte time apart form a burst. Memory is constant: the
+    counters of the open window and the capture, and a histogram of
+    burst lengths.
+    '''
+
+    def __init__(self, window):
+        self.window = window
+        self.bytes = {'H->D': 0, 'D->H': 0}
+        self.busy = {'H->D': 0, 'D->H': 0}
+        self.window_ss = None
+        self.window_bytes = {'H->D': 0, 'D->H': 0}
+        self.window_busy = {'H->D': 0, 'D->H': 0}
+        self.window_burst = 0
+        self.carry = None
+        self.windows = 0
+        self.peak_bytes = 0
+        self.peak_busy = 0
+        self.bursts = Histogram()
+        self.burst = 0
+        self.prev = None
+        self.first = None
+        self.last = None
+
+    def feed(self, ss, es, direction):
+        if self.first is None:
+            self.first = self.window_ss = ss
+        self.last = es
+        self.bytes[direction] += 1
+        self.busy[direction] += es - ss
+        self.window_bytes[direction] += 1
+        end = self.window_ss + self.window
+        self.window_busy[direction] += min(es, end) - ss
+        if es > end:
+            self.carry = direction, es
+        prev = self.prev
+        if prev and ss - prev[1] < prev[1] - prev[0]:
+            self.burst += 1
+        else:
+            if self.burst:
+                self.bursts.add(self.burst)
+            self.burst = 1
+        self.prev = ss, es
+        self.window_burst = max(self.window_burst, self.burst)
+
+    def close(self, end):
+        '''Count the open window, ending at end, towards the peaks. The
+        peaks and windows only count full windows.'''
+        if end - self.window_ss < self.window:
+            return
+        self.windows += 1
+        self.peak_bytes = max(self.peak_bytes, sum(self.window_bytes.values()))
+        self.peak_busy = max(self.peak_busy, sum(self.window_busy.values()))
+
+    def next_window(self, ss):
+        '''Close the open window and start the one holding ss.'''
+        self.close(self.window_ss + self.window)
+        self.window_ss = ss - (ss - self.first) % self.window
+        self.window_bytes = {'H->D': 0, 'D->H': 0}
+        self.window_busy = {'H->D': 0, 'D->H': 0}
+        self.window_burst = self.burst
+        if self.carry:
+            direction, es = self.carry
+            self.carry = None
+            if es > self.window_ss:
+                self.window_busy[direction] = min(es, self.window_ss + self.window) - self.window_ss
+                if es > self.window_ss + self.window:
+                    self.carry = direction, es
+
+    def finish(self):
+        '''Close the open window at the end of the last byte, and the last
+        burst.'''
+        self.close(self.last)
+        if self.burst:
+            self.bursts.add(self.burst)
+            self.burst = 0
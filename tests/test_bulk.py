@@ -0,0 +1,51 @@
+import random
+import time
+import unittest
+from ..engine import decode
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+else:
+    from ..bulk import decode_arrays
+
+def serial(cs, host, data):
+    records = [(i, i, 'H->D' if h else 'D->H', byte)
+            for i, (h, byte) in enumerate(zip(host, data))]
+    return [(ss, event.kind, event.code, event.flags)
+            for ss, _, event in decode(records, cs)]
+
+def bulk(cs, host, data):
+    res = decode_arrays(host, data, cs)
+    return list(zip(res.index.tolist(), res.kind.tolist(), res.code.tolist(),
+            res.flags.tolist()))
+
+@unittest.skipIf(numpy is None, 'requires NumPy')
+class BulkTest(unittest.TestCase):
+
+    def test_random(self):
+        # Prefix and sequence heavy streams, with broken E1 sequences.
+        rnd = random.Random(1)
+        pool = [0xE0, 0xE1, 0xF0, 0x14, 0x77, 0x1D, 0x45, 0x9D, 0xC5, 0x12, 0x59, 0x1C]
+        for cs in ('cs1', 'cs2', 'cs3'):
+            host = [rnd.random() < 0.03 for _ in range(20000)]
+            data = [rnd.choice(pool) if rnd.random() < 0.8 else rnd.randrange(256)
+                    for _ in host]
+            with self.subTest(cs=cs):
+                self.assertEqual(bulk(cs, host, data), serial(cs, host, data))
+
+    def test_long_runs(self):
+        # A held Left Control is a long run of a sequence byte, which
+        # must not cost a pass per byte.
+        for cs, data in (('cs2', [0xE1] + [0x14] * 200000),
+                ('cs1', [0xE1] + [0x1D] * 100000 + [0x9D] * 100000)):
+            host = [0] * len(data)
+            with self.subTest(cs=cs):
+                t0 = time.perf_counter()
+                res = bulk(cs, host, data)
+                self.assertLess(time.perf_counter() - t0, 10)
+                self.assertEqual(res, serial(cs, host, data))
+
+if __name__ == '__main__':
+    unittest.main()
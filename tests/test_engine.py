@@ -0,0 +1,86 @@
+import unittest
+from ..engine import BREAK, E0, E1, Anomaly, Engine, Kind, decode
+
+def feed(cs, data):
+    '''(kind, code, flags) of the events decoded from device bytes.'''
+    records = [(i, i, 'D->H', byte) for i, byte in enumerate(data)]
+    return [(event.kind, event.code, event.flags) for _, _, event in decode(records, cs)]
+
+def key(code, flags=0):
+    return Kind.KEY, code, flags
+
+class SharedCodesTest(unittest.TestCase):
+    # Keys whose codes are also bytes of multi-byte sequences must decode
+    # on their own, before and after a complete sequence.
+
+    shared = {
+        'cs1': (0x1D, 0x45, 0x2A, 0x36),
+        'cs2': (0x14, 0x12, 0x77, 0x59),
+    }
+    pause = {
+        'cs1': [0xE1, 0x1D, 0x45, 0xE1, 0x9D, 0xC5],
+        'cs2': [0xE1, 0x14, 0x77, 0xE1, 0xF0, 0x14, 0xF0, 0x77],
+    }
+
+    def make_break(self, cs, code):
+        if cs == 'cs1':
+            return [code, code | 0x80]
+        return [code, 0xF0, code]
+
+    def test_make_break(self):
+        for cs, codes in self.shared.items():
+            for code in codes:
+                with self.subTest(cs=cs, code=code):
+                    self.assertEqual(feed(cs, self.make_break(cs, code)),
+                            [key(code), key(code, BREAK)])
+
+    def test_around_pause(self):
+        for cs, codes in self.shared.items():
+            pause = key(self.pause[cs][1], E1)
+            for code in codes:
+                with self.subTest(cs=cs, code=code):
+                    data = self.make_break(cs, code)
+                    self.assertEqual(feed(cs, data + self.pause[cs] + data),
+                            [key(code), key(code, BREAK), pause,
+                            key(code), key(code, BREAK)])
+
+    def test_e0(self):
+        # E0 1D and E0 14 are Right Control, not part of Pause.
+        self.assertEqual(feed('cs1', [0xE0, 0x1D, 0xE0, 0x9D]),
+                [key(0x1D, E0), key(0x1D, E0 | BREAK)])
+        self.assertEqual(feed('cs2', [0xE0, 0x14, 0xE0, 0xF0, 0x14]),
+                [key(0x14, E0), key(0x14, E0 | BREAK)])
+
+    def test_fake_shifts(self):
+        # Print Screen make and break with their fake shifts.
+        self.assertEqual(feed('cs2', [0xE0, 0x12, 0xE0, 0x7C, 0xE0, 0xF0, 0x7C,
+                0xE0, 0xF0, 0x12]), [key(0x7C, E0), key(0x7C, E0 | BREAK)])
+        self.assertEqual(feed('cs1', [0xE0, 0x2A, 0xE0, 0x37, 0xE0, 0xB7, 0xE0, 0xAA]),
+                [key(0x37, E0), key(0x37, E0 | BREAK)])
+
+class BrokenSequenceTest(unittest.TestCase):
+
+    def test_replay(self):
+        # The bytes taken by the broken sequence are decoded again.
+        self.assertEqual(feed('cs2', [0xE1, 0x14, 0x1C]),
+                [(Kind.ERROR, 0x1C, Anomaly.SEQUENCE), key(0x14), key(0x1C)])
+        self.assertEqual(feed('cs1', [0xE1, 0x1D, 0x9D]),
+                [(Kind.ERROR, 0x9D, Anomaly.SEQUENCE), key(0x1D), key(0x1D, BREAK)])
+
+    def test_replay_prefix(self):
+        # A replay ending in a prefix leaves the engine in that state.
+        self.assertEqual(feed('cs2', [0xE1, 0x14, 0x77, 0xE1, 0xF0, 0x1C]),
+                [(Kind.ERROR, 0x1C, Anomaly.SEQUENCE), key(0x14), key(0x77),
+                (Kind.ERROR, 0xF0, Anomaly.SEQUENCE), key(0x1C, BREAK)])
+        engine = Engine('cs2')
+        for byte in (0xE1, 0x14, 0xE0):
+            event = engine.feed('D->H', byte)
+        self.assertEqual([e.code for e in event.replay], [0x14])
+        self.assertEqual(engine.feed('D->H', 0x71).flags, E0)
+
+    def test_restart(self):
+        self.assertEqual(feed('cs2', [0xE1, 0xE1, 0x14, 0x77, 0xE1, 0xF0, 0x14, 0xF0, 0x77]),
+                [(Kind.ERROR, 0xE1, Anomaly.SEQUENCE), key(0x14, E1)])
+
+if __name__ == '__main__':
+    unittest.main()
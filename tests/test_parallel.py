@@ -0,0 +1,26 @@
+import random
+import unittest
+from ..engine import decode
+from ..parallel import decode_parallel
+
+class ParallelTest(unittest.TestCase):
+
+    def test_matches_serial(self):
+        # Prefix heavy streams with broken E1 sequences, whose replayed
+        # events must come out too, split at sequence bytes or not.
+        rnd = random.Random(2)
+        pool = [0xE0, 0xE1, 0xF0, 0x14, 0x77, 0x1D, 0x45, 0x9D, 0xC5, 0x12, 0x59, 0x1C]
+        for cs in ('cs1', 'cs2', 'cs3'):
+            host = bytes(rnd.random() < 0.03 for _ in range(20000))
+            data = bytes(rnd.choice(pool) if rnd.random() < 0.8 else rnd.randrange(256)
+                    for _ in host)
+            records = [(i, i, 'H->D' if h else 'D->H', byte)
+                    for i, (h, byte) in enumerate(zip(host, data))]
+            serial = [(ss, event) for ss, _, event in decode(records, cs)]
+            for chunk_size in (1, 7, 97, 4096, 1 << 20):
+                with self.subTest(cs=cs, chunk_size=chunk_size):
+                    self.assertEqual(list(decode_parallel(host, data, cs, jobs=2,
+                            chunk_size=chunk_size, threads=True)), serial)
+
+if __name__ == '__main__':
+    unittest.main()